@@ -0,0 +1,218 @@
+# bench.py
+# Perft and micro-benchmarks for the rules engine.
+#
+#   python bench.py                          # run, print JSON
+#   python bench.py -o bench_output.txt      # also save it
+#   python bench.py --baseline old.json      # compare against a saved run
+#
+# Perft counts every leaf reached by playing all legal moves to depth N
+# (finished games are not expanded). The expected counts below were taken
+# from the original list-of-lists engine, so any rules change shows up as a
+# mismatch (the 11x11 and 13x13 counts were taken when those boards were
+# added). Exit code is 1 on a perft mismatch or a timing regression.
+import sys
+import json
+import time
+import argparse
+import platform
+from array import array
+
+from bitboard import KING, DEFENDER, ATTACKER, BOARD_SIZE, MOVE_SHIFT, MOVE_MASK
+from engine import Hnefatafl
+
+# ------------------ TEST POSITIONS ------------------
+# name, rows ('.' empty, K king, D defender, A attacker), side to move,
+# expected perft counts for depth 1, 2, 3, board size (the starting position
+# when rows is None)
+PIECE_CHARS = {"K": KING, "D": DEFENDER, "A": ATTACKER}
+POSITIONS = [
+    ("start-defender", None, DEFENDER, [20, 1556, 45576], 9),
+    ("start-attacker", None, ATTACKER, [80, 1656, 129556], 9),
+    ("opening",
+     ".A.A.A.../....A..../....D..../A..D...DA/...DKD.AA/A..DD..../.A......./....A..D./......A..",
+     ATTACKER, [80, 3980, 311062], 9),
+    ("middlegame",
+     ".....A.../........./....AD.../A..AD...A/AAD.K..../....DD.../....D..A./...D..DA./.A...A.A.",
+     ATTACKER, [67, 4083, 273861], 9),
+    ("king-out",
+     ".A......./...A...../A.D....D./....A..DA/A..DKD.../.......AA/..AD...../...A...../...A.D.D.",
+     ATTACKER, [77, 4229, 316251], 9),
+    ("start-11x11", None, ATTACKER, [116, 6788, 806344], 11),
+    ("start-13x13", None, ATTACKER, [160, 13740, 2280104], 13),
+    # king one move from a corner: the larger boards restrict the corners
+    # and castle to the king, so these cover the king's own destinations
+    ("king-corner-11x11",
+     "..K.A....../.........../A........../...D...A.../..........A/A...D....../"
+     "......D..../.....A...../.........../.........A./...A.......",
+     DEFENDER, [65, 7632, 471579], 11),
+    ("king-corner-13x13",
+     "...A........./.....A......./K............/............./.A..D......../"
+     "........A..../.....D......A/............./.......D...../..A........../"
+     "............./...........A./......A......",
+     DEFENDER, [90, 14286, 1210321], 13),
+    # king next to two attackers: a pair does not take it on 11x11, the
+    # four sides have to be closed (bitboard.SURROUND_KING)
+    ("king-surround-11x11",
+     "....A....../.........../...A......./..AK......./......D..../.....D...A./"
+     "A.....D..../..D......../...A......./.........../......A....",
+     ATTACKER, [92, 6710, 618520], 11),
+]
+
+
+def load_position(rows, side, size=BOARD_SIZE):
+    game = Hnefatafl(size=size)
+    if rows is None:
+        game.current_player = side
+        return game
+    bitboards = [0, 0, 0]
+    for row, line in enumerate(rows.split("/")):
+        for col, ch in enumerate(line):
+            if ch in PIECE_CHARS:
+                bitboards[PIECE_CHARS[ch]] |= 1 << (row * size + col)
+    game.set_position(bitboards, side)
+    return game
+
+
+# ------------------ PERFT ------------------
+def perft(game, depth, buffers=None):
+    if buffers is None:
+        buffers = [array("I", bytes(4 * game.geo.max_moves)) for _ in range(depth + 1)]
+    if depth == 0:
+        return 1
+    if game.game_over:
+        return 0
+    buf = buffers[depth]
+    n = game.generate_moves(game.current_player, buf)
+    if depth == 1:
+        return n
+    nodes = 0
+    for i in range(n):
+        move = buf[i]
+        game.make_move(move >> MOVE_SHIFT, move & MOVE_MASK)
+        nodes += perft(game, depth - 1, buffers)
+        game.unmake_move()
+    return nodes
+
+
+def run_perft(max_depth):
+    results = []
+    for name, rows, side, expected, size in POSITIONS:
+        game = load_position(rows, side, size)
+        for depth in range(1, max_depth + 1):
+            start = time.perf_counter()
+            nodes = perft(game, depth)
+            elapsed = time.perf_counter() - start
+            want = expected[depth - 1] if depth <= len(expected) else None
+            results.append({
+                "name": name,
+                "depth": depth,
+                "nodes": nodes,
+                "expected": want,
+                "ok": want is None or nodes == want,
+                "seconds": round(elapsed, 6),
+                "nps": int(nodes / elapsed) if elapsed > 0 else 0,
+            })
+    return results
+
+
+# ------------------ MICRO BENCHMARKS ------------------
+def _time_calls(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def run_micro(calls):
+    game = load_position(POSITIONS[3][1], POSITIONS[3][2])
+    king_row, king_col = divmod(game.king_sq, BOARD_SIZE)
+    n = game.generate_moves()
+    first = game.move_buffer[0]
+    (fr, fc), (tr, tc) = divmod(first >> MOVE_SHIFT, BOARD_SIZE), divmod(first & MOVE_MASK, BOARD_SIZE)
+
+    def move_and_undo():
+        game.move_piece(fr, fc, tr, tc, send=False)
+        game.unmake_move()
+
+    # check_captures on a piece that has nothing to take, so repeats don't change the board
+    cap_row, cap_col = fr, fc
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            if game.board[row][col] is not None:
+                probe = game.clone()
+                probe.check_captures(row, col)
+                if probe.bitboards == game.bitboards:
+                    cap_row, cap_col = row, col
+
+    def captures():
+        game.check_captures(cap_row, cap_col)
+
+    benches = {
+        "get_valid_moves": lambda: game.get_valid_moves(fr, fc),
+        "generate_moves": game.generate_moves,
+        # move_piece is timed together with the unmake_move that resets it
+        "move_piece": move_and_undo,
+        "check_captures": captures,
+        "check_king_capture": lambda: game.check_king_capture(king_row, king_col),
+    }
+    out = {}
+    for name, fn in benches.items():
+        out[name] = {"calls": calls, "ns_per_call": round(_time_calls(fn, calls), 1)}
+    out["generate_moves"]["moves"] = n
+    return out
+
+
+# ------------------ BASELINE ------------------
+def compare(report, baseline, tolerance):
+    """List of human readable problems; empty when report is no worse than baseline."""
+    problems = []
+    base_perft = {(p["name"], p["depth"]): p for p in baseline.get("perft", [])}
+    for p in report["perft"]:
+        old = base_perft.get((p["name"], p["depth"]))
+        if old is None:
+            continue
+        if old["nodes"] != p["nodes"]:
+            problems.append(f"perft {p['name']} d{p['depth']}: {p['nodes']} nodes, baseline {old['nodes']}")
+        elif old["nps"] and p["nps"] < old["nps"] * (1 - tolerance):
+            problems.append(f"perft {p['name']} d{p['depth']}: {p['nps']} nps, baseline {old['nps']}")
+    for name, m in report["micro"].items():
+        old = baseline.get("micro", {}).get(name)
+        if old and m["ns_per_call"] > old["ns_per_call"] * (1 + tolerance):
+            problems.append(f"{name}: {m['ns_per_call']} ns/call, baseline {old['ns_per_call']}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hnefatafl engine perft and micro-benchmarks")
+    parser.add_argument("--depth", type=int, default=3, help="perft depth (default 3)")
+    parser.add_argument("--calls", type=int, default=20000, help="calls per micro-benchmark")
+    parser.add_argument("-o", "--output", help="write the JSON report here as well")
+    parser.add_argument("--baseline", help="JSON report from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed slowdown vs baseline before failing (default 0.15)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "perft": run_perft(args.depth),
+        "micro": run_micro(args.calls),
+    }
+    failed = [f"perft {p['name']} d{p['depth']}: {p['nodes']} nodes, expected {p['expected']}"
+              for p in report["perft"] if not p["ok"]]
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed += compare(report, json.load(f), args.tolerance)
+    report["problems"] = failed
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
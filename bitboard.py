@@ -0,0 +1,308 @@
+# bitboard.py
+# Integer bitboards for the Hnefatafl engine.
+#
+# Square index is row * size + col and a position is stored as one Python
+# int per piece type, with bit (1 << sq) set when that square holds such a
+# piece. Everything the rules need for one board size (castle, throne,
+# edges, corners, escape and restricted squares, neighbours and sliding
+# rays, the starting layout) lives in a Geometry. One Geometry per
+# supported size is built at import time and shared by every game of that
+# size; geometry(size) looks it up.
+
+# the original 9x9 board; the default everywhere a size isn't given
+BOARD_SIZE = 9
+BOARD_SIZES = (9, 11, 13, 19)
+
+# piece types, also the index into a position's list of bitboards
+KING = 0
+DEFENDER = 1
+ATTACKER = 2
+# piece type a mover can sandwich, indexed by the mover (the king captures nothing)
+VICTIM = [None, ATTACKER, DEFENDER]
+# side (DEFENDER or ATTACKER) that owns each piece type
+SIDE_OF = [DEFENDER, DEFENDER, ATTACKER]
+
+# up, down, left, right (same order the old per-cell loops used)
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+# down/right walk towards higher square indices
+RAY_POSITIVE = [False, True, False, True]
+
+# ------------------ VARIANTS ------------------
+# Starting layouts ('.' empty, K king, D defender, A attacker). Every layout
+# is symmetric under the 8 rotations/reflections of the board, which
+# canonical hashing relies on.
+LAYOUTS = {
+    # the original board: edge escape, Tablut-like
+    9: ("...A.A...",
+        "....A....",
+        ".........",
+        "A..DDD..A",
+        ".A.DKD.A.",
+        "A..DDD..A",
+        ".........",
+        "....A....",
+        "...A.A..."),
+    # Hnefatafl / Copenhagen
+    11: ("...AAAAA...",
+         ".....A.....",
+         "...........",
+         "A....D....A",
+         "A...DDD...A",
+         "AA.DDKDD.AA",
+         "A...DDD...A",
+         "A....D....A",
+         "...........",
+         ".....A.....",
+         "...AAAAA..."),
+    13: ("....AAAAA....",
+         "......A......",
+         ".............",
+         ".............",
+         "A.....D.....A",
+         "A.....D.....A",
+         "AA..DDKDD..AA",
+         "A.....D.....A",
+         "A.....D.....A",
+         ".............",
+         ".............",
+         "......A......",
+         "....AAAAA...."),
+    # Alea Evangelii: 24 defenders and the king against 48 attackers
+    19: (".......AAAAA.......",
+         ".........A.........",
+         "........A.A........",
+         ".....A.......A.....",
+         "....A....D....A....",
+         "...A.A.......A.A...",
+         ".........D.........",
+         "A......D.D.D......A",
+         "A.A.....DDD.....A.A",
+         "AA..D.DDDKDDD.D..AA",
+         "A.A.....DDD.....A.A",
+         "A......D.D.D......A",
+         ".........D.........",
+         "...A.A.......A.A...",
+         "....A....D....A....",
+         ".....A.......A.....",
+         "........A.A........",
+         ".........A.........",
+         ".......AAAAA......."),
+}
+# The 9x9 game is won by reaching any edge and only keeps attackers out of
+# the corners; the larger boards are played to the corners, only the king
+# may stop on a corner or the castle, and those squares (the castle only
+# while the king is off it) take part in captures like an enemy piece.
+EDGE_ESCAPE = {9}
+# Copenhagen king capture: the king must be surrounded on all four sides
+# by attackers (or three and the empty castle), so it is safe on the edge.
+# The other boards take the king like the 9x9 game: four attackers on the
+# castle, three and the castle next to it, otherwise two on opposite sides.
+# Shieldwall captures and edge forts are not implemented on any board.
+SURROUND_KING = {11}
+
+_PIECE_CHARS = {"K": KING, "D": DEFENDER, "A": ATTACKER}
+
+# ------------------ MOVE ENCODING ------------------
+# A move is one int: from_sq << MOVE_SHIFT | to_sq. 9 bits per square leaves
+# room for boards up to 22x22.
+MOVE_SHIFT = 9
+MOVE_MASK = (1 << MOVE_SHIFT) - 1
+
+
+def encode_move(from_sq, to_sq):
+    return from_sq << MOVE_SHIFT | to_sq
+
+
+def decode_move(move):
+    return move >> MOVE_SHIFT, move & MOVE_MASK
+
+
+def iter_bits(mask):
+    """Yield the square index of every set bit, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# ------------------ GEOMETRY ------------------
+class Geometry:
+    """Precomputed tables for one board size.
+
+    Attribute names follow the old module-level constants in lower case
+    (SQUARE_BIT -> square_bit, RAY_SQUARES -> ray_squares, ...).
+    """
+
+    def __init__(self, size):
+        if size * size > MOVE_MASK + 1:
+            raise ValueError(f"board size {size} does not fit the move encoding")
+        n = size * size
+        self.size = size
+        self.num_squares = n
+        self.center = center = size // 2
+        square = self.square
+        in_bounds = self.in_bounds
+
+        # ---- square masks ----
+        self.square_bit = bit = [1 << sq for sq in range(n)]
+        self.all_mask = (1 << n) - 1
+        self.castle_mask = bit[square(center, center)]
+        # the castle plus the four squares next to it
+        self.throne_mask = self.castle_mask
+        for dr, dc in DIRECTIONS:
+            self.throne_mask |= bit[square(center + dr, center + dc)]
+        self.edge_mask = 0
+        for i in range(size):
+            self.edge_mask |= bit[square(0, i)] | bit[square(size - 1, i)]
+            self.edge_mask |= bit[square(i, 0)] | bit[square(i, size - 1)]
+        self.corner_mask = (bit[square(0, 0)] | bit[square(0, size - 1)] |
+                            bit[square(size - 1, 0)] | bit[square(size - 1, size - 1)])
+
+        # ---- variant rules ----
+        # escape_mask: where the king wins; escape_distance[sq]: king steps from sq to it
+        # hostile_mask: empty squares a piece can be sandwiched against
+        if size in EDGE_ESCAPE:
+            self.escape_mask = self.edge_mask
+            self.restricted_mask = self.corner_mask
+            self.hostile_mask = 0
+            # squares each piece type may land on (corners are reserved for the king side)
+            self.allowed_destinations = [self.all_mask, self.all_mask,
+                                         self.all_mask & ~self.corner_mask]
+        else:
+            self.escape_mask = self.corner_mask
+            self.restricted_mask = self.corner_mask | self.castle_mask
+            self.hostile_mask = self.restricted_mask
+            others = self.all_mask & ~self.restricted_mask
+            self.allowed_destinations = [self.all_mask, others, others]
+        self.escape_distance = []
+        for sq in range(n):
+            row, col = divmod(sq, size)
+            dr, dc = min(row, size - 1 - row), min(col, size - 1 - col)
+            self.escape_distance.append(min(dr, dc) if size in EDGE_ESCAPE else dr + dc)
+        # surround_king: the king is only taken when enclosed on all four sides
+        self.surround_king = size in SURROUND_KING
+
+        # ---- neighbour / ray tables ----
+        # neighbour[d][sq] -> square one step in direction d, or -1 off the board
+        # ray[d][sq]       -> mask of every square from sq (exclusive) to the edge
+        self.neighbour = [[-1] * n for _ in DIRECTIONS]
+        self.ray = [[0] * n for _ in DIRECTIONS]
+        self.neighbour_mask = [0] * n
+        for sq in range(n):
+            row, col = divmod(sq, size)
+            for d, (dr, dc) in enumerate(DIRECTIONS):
+                r, c = row + dr, col + dc
+                if in_bounds(r, c):
+                    self.neighbour[d][sq] = square(r, c)
+                    self.neighbour_mask[sq] |= bit[square(r, c)]
+                while in_bounds(r, c):
+                    self.ray[d][sq] |= bit[square(r, c)]
+                    r, c = r + dr, c + dc
+        neighbour = self.neighbour
+
+        # capture_pairs[sq] -> (target_sq, target_bit, beyond_bit) for every
+        # direction where both the neighbour and the square behind it exist
+        # king_pairs[sq] -> masks of the two squares on either side of sq
+        # along each axis (only axes where both squares exist)
+        # ray_squares[sq] -> for each direction, the squares from sq outwards to the edge
+        self.capture_pairs = []
+        self.king_pairs = []
+        self.ray_squares = []
+        for sq in range(n):
+            pairs = []
+            rays = []
+            for d in range(len(DIRECTIONS)):
+                t = neighbour[d][sq]
+                if t >= 0 and neighbour[d][t] >= 0:
+                    pairs.append((t, bit[t], bit[neighbour[d][t]]))
+                ray = []
+                while t >= 0:
+                    ray.append(t)
+                    t = neighbour[d][t]
+                rays.append(tuple(ray))
+            self.capture_pairs.append(tuple(pairs))
+            self.ray_squares.append(tuple(rays))
+
+            axes = []
+            for a, b in ((0, 1), (2, 3)):
+                if neighbour[a][sq] >= 0 and neighbour[b][sq] >= 0:
+                    axes.append(bit[neighbour[a][sq]] | bit[neighbour[b][sq]])
+            self.king_pairs.append(tuple(axes))
+
+        # ---- symmetries ----
+        # The castle, throne, corners and every starting layout are invariant
+        # under the 8 rotations and reflections of the square, so those 8
+        # images of a position are the same game. symmetries[k][sq] is where
+        # sq lands under transform k.
+        m = size - 1
+        transforms = [
+            lambda r, c: (r, c),
+            lambda r, c: (c, m - r),        # rotate 90
+            lambda r, c: (m - r, m - c),    # rotate 180
+            lambda r, c: (m - c, r),        # rotate 270
+            lambda r, c: (r, m - c),        # mirror left/right
+            lambda r, c: (m - r, c),        # mirror up/down
+            lambda r, c: (c, r),            # main diagonal
+            lambda r, c: (m - c, m - r),    # anti diagonal
+        ]
+        self.symmetries = [[square(*t(*divmod(sq, size))) for sq in range(n)] for t in transforms]
+        # inverse_symmetries[k][symmetries[k][sq]] == sq
+        self.inverse_symmetries = []
+        for perm in self.symmetries:
+            inverse = [0] * n
+            for sq, image in enumerate(perm):
+                inverse[image] = sq
+            self.inverse_symmetries.append(inverse)
+
+        # ---- starting position ----
+        self.layout = [0, 0, 0]
+        rows = LAYOUTS[size]
+        if len(rows) != size or any(len(line) != size for line in rows):
+            raise ValueError(f"layout for {size}x{size} has the wrong shape")
+        for row, line in enumerate(rows):
+            for col, ch in enumerate(line):
+                if ch in _PIECE_CHARS:
+                    self.layout[_PIECE_CHARS[ch]] |= bit[square(row, col)]
+
+        # upper bound on moves in one position: every square holding a piece
+        # that can slide the full length of its row and column
+        self.max_moves = n * 2 * (size - 1)
+
+    def __repr__(self):
+        return f"Geometry({self.size})"
+
+    def square(self, row, col):
+        return row * self.size + col
+
+    def in_bounds(self, row, col):
+        return 0 <= row < self.size and 0 <= col < self.size
+
+    def ray_moves(self, sq, d, occupied):
+        """Empty squares reachable from sq in direction d before the first blocker."""
+        ray = self.ray[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if RAY_POSITIVE[d]:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= self.ray[d][first] | self.square_bit[first]
+        return ray
+
+    def sliding_moves(self, sq, occupied):
+        """Rook-style destinations from sq given the occupancy mask."""
+        return (self.ray_moves(sq, 0, occupied) | self.ray_moves(sq, 1, occupied) |
+                self.ray_moves(sq, 2, occupied) | self.ray_moves(sq, 3, occupied))
+
+
+GEOMETRIES = {size: Geometry(size) for size in BOARD_SIZES}
+# big enough for a generate_moves buffer on any supported board
+MAX_MOVES = max(geo.max_moves for geo in GEOMETRIES.values())
+
+
+def geometry(size=BOARD_SIZE):
+    """Shared Geometry for a supported board size (ValueError otherwise)."""
+    try:
+        return GEOMETRIES[size]
+    except KeyError:
+        raise ValueError(f"unsupported board size {size}; choose from {BOARD_SIZES}") from None
@@ -0,0 +1,427 @@
+# engine.py
+# Hnefatafl rules engine, importable without pygame.
+#
+# The client (main.py), the AI/search code, the benchmarks and the relay
+# all share this class; nothing here touches pygame or sockets (move_piece
+# only calls net.send_json when a NetClient has been attached).
+from array import array
+
+from bitboard import (BOARD_SIZE, BOARD_SIZES, KING, DEFENDER, ATTACKER, VICTIM, MOVE_SHIFT,
+                      geometry, iter_bits)
+from zobrist import KEYS, hash_bitboards
+
+__all__ = ["Hnefatafl", "BOARD_SIZE", "BOARD_SIZES", "KING", "DEFENDER", "ATTACKER"]
+
+
+class Hnefatafl:
+    def __init__(self, debug=False, symmetric=False, size=BOARD_SIZE):
+        # board size and its shared tables (bitboard.Geometry, zobrist.ZobristKeys)
+        self.geo = geometry(size)
+        self.size = self.geo.size
+        self.keys = KEYS[self.size]
+        # one bitboard per piece type, indexed by KING / DEFENDER / ATTACKER
+        self.bitboards = [0, 0, 0]
+        # kept up to date by _put/_remove so win checks never scan the board
+        self.piece_counts = [0, 0, 0]
+        self.king_sq = None
+        # debug: cross-check the incremental state against a full scan after every move
+        self.debug = debug
+        # symmetric: also keep hashes of the 8 rotated/reflected boards so
+        # canonical_hash() is O(1) (costs 8x the hash updates)
+        self.symmetric = symmetric
+        self._board_view = None
+        # default output buffer for generate_moves
+        self.move_buffer = array("I", bytes(4 * self.geo.max_moves))
+        self.selected_piece = None
+        self.current_player = DEFENDER
+        self.game_over = False
+        self.winner = None
+        # make_move/unmake_move history, one tuple per move
+        self.undo_stack = []
+        self.setup_board()
+
+        # Multiplayer / mode fields
+        self.my_side = None        # "DEFENDER", "ATTACKER", or "LOCAL"
+        self.turn_side = None      # "DEFENDER" or "ATTACKER"
+        self.my_name = None
+        self.opponent_name = None
+        self.waiting = True        # lobby/wait state
+        self.net = None
+
+    # ------------------ BOARD STATE ------------------
+    @property
+    def board(self):
+        """List-of-lists view (None/KING/DEFENDER/ATTACKER) for drawing and the UI.
+
+        Built from the bitboards on first access and cached until the
+        position changes.
+        """
+        if self._board_view is None:
+            size = self.size
+            view = [[None] * size for _ in range(size)]
+            for piece in (KING, DEFENDER, ATTACKER):
+                for sq in iter_bits(self.bitboards[piece]):
+                    row, col = divmod(sq, size)
+                    view[row][col] = piece
+            self._board_view = view
+        return self._board_view
+
+    def occupied(self):
+        bb = self.bitboards
+        return bb[KING] | bb[DEFENDER] | bb[ATTACKER]
+
+    def piece_at(self, sq):
+        bit = 1 << sq
+        bb = self.bitboards
+        if bb[ATTACKER] & bit:
+            return ATTACKER
+        if bb[DEFENDER] & bit:
+            return DEFENDER
+        if bb[KING] & bit:
+            return KING
+        return None
+
+    def _put(self, piece, sq):
+        self.bitboards[piece] |= 1 << sq
+        self.piece_counts[piece] += 1
+        if piece == KING:
+            self.king_sq = sq
+        self._hash ^= self.keys.piece_keys[piece][sq]
+        if self._sym_hashes is not None:
+            self._update_sym_hashes(piece, sq)
+        self._board_view = None
+
+    def _remove(self, piece, sq):
+        self.bitboards[piece] &= ~(1 << sq)
+        self.piece_counts[piece] -= 1
+        if piece == KING:
+            self.king_sq = None
+        self._hash ^= self.keys.piece_keys[piece][sq]
+        if self._sym_hashes is not None:
+            self._update_sym_hashes(piece, sq)
+        self._board_view = None
+
+    def _update_sym_hashes(self, piece, sq):
+        hashes = self._sym_hashes
+        sym_keys = self.keys.sym_piece_keys
+        for k in range(8):
+            hashes[k] ^= sym_keys[k][piece][sq]
+
+    def clone(self):
+        """Engine-only copy of the position (no UI, network or undo history)."""
+        g = Hnefatafl(debug=self.debug, symmetric=self.symmetric, size=self.size)
+        g.bitboards = list(self.bitboards)
+        g.piece_counts = list(self.piece_counts)
+        g.king_sq = self.king_sq
+        g._hash = self._hash
+        g._sym_hashes = list(self._sym_hashes) if self._sym_hashes is not None else None
+        g.position_counts = dict(self.position_counts)
+        g.current_player = self.current_player
+        g.game_over = self.game_over
+        g.winner = self.winner
+        g._board_view = None
+        return g
+
+    def pack(self):
+        """Compact, picklable position: (kings, defenders, attackers, side to move, size)."""
+        bb = self.bitboards
+        return (bb[KING], bb[DEFENDER], bb[ATTACKER], self.current_player, self.size)
+
+    @classmethod
+    def from_packed(cls, packed):
+        game = cls(size=packed[4])
+        game.set_position(list(packed[:3]), packed[3])
+        return game
+
+    # ------------------ HASHING ------------------
+    def zobrist_hash(self):
+        """64-bit hash of piece placement and side to move."""
+        return self._hash ^ (self.keys.side_key if self.current_player == ATTACKER else 0)
+
+    def canonical_hash(self):
+        """Hash that is identical for all 8 rotations/reflections of the position."""
+        if self._sym_hashes is not None:
+            placement = min(self._sym_hashes)
+        else:
+            placement = min(hash_bitboards(self.bitboards, keys) for keys in self.keys.sym_piece_keys)
+        return placement ^ (self.keys.side_key if self.current_player == ATTACKER else 0)
+
+    def canonical_key(self):
+        """(canonical_hash(), k) with k the symmetry that maps this position to the canonical one.
+
+        Square sq of this board is square geo.symmetries[k][sq] of the
+        canonical board; geo.inverse_symmetries[k] maps back.
+        """
+        hashes = self._sym_hashes
+        if hashes is None:
+            hashes = [hash_bitboards(self.bitboards, keys) for keys in self.keys.sym_piece_keys]
+        k = min(range(8), key=hashes.__getitem__)
+        return hashes[k] ^ (self.keys.side_key if self.current_player == ATTACKER else 0), k
+
+    def enable_symmetric(self):
+        """Start keeping the 8 symmetric hashes (as symmetric=True does) from the current position."""
+        if self._sym_hashes is None:
+            self.symmetric = True
+            self._sym_hashes = [hash_bitboards(self.bitboards, keys)
+                                for keys in self.keys.sym_piece_keys]
+
+    def repetitions(self):
+        """How many times the current position has been reached by make_move."""
+        return self.position_counts.get(self.zobrist_hash(), 0)
+
+    def verify_state(self):
+        """Full-board scan that checks king_sq and piece_counts (debug mode)."""
+        counts = [0, 0, 0]
+        king_sq = None
+        for sq in range(self.geo.num_squares):
+            piece = self.piece_at(sq)
+            if piece is not None:
+                counts[piece] += 1
+                if piece == KING:
+                    king_sq = sq
+        if hash_bitboards(self.bitboards, self.keys.piece_keys) != self._hash:
+            raise RuntimeError("zobrist hash out of sync")
+        if counts != self.piece_counts or king_sq != self.king_sq:
+            raise RuntimeError(f"engine state out of sync: counts {self.piece_counts} "
+                               f"(scan {counts}), king {self.king_sq} (scan {king_sq})")
+        if king_sq is not None and 1 << king_sq & self.geo.escape_mask and not self.game_over:
+            raise RuntimeError("king on an escape square but game not over")
+        if king_sq is None and not (self.game_over and self.winner == ATTACKER):
+            raise RuntimeError("king missing but attackers have not won")
+
+    def _clear(self):
+        self.bitboards = [0, 0, 0]
+        self.piece_counts = [0, 0, 0]
+        self.king_sq = None
+        self.undo_stack = []
+        self._hash = 0
+        self._sym_hashes = [0] * 8 if self.symmetric else None
+        # zobrist_hash() -> times reached, for repetition detection
+        self.position_counts = {}
+        self._board_view = None
+
+    def setup_board(self):
+        """Starting position of this board size (bitboard.LAYOUTS)."""
+        self._clear()
+        for piece, mask in enumerate(self.geo.layout):
+            for sq in iter_bits(mask):
+                self._put(piece, sq)
+
+    def set_position(self, bitboards, current_player=DEFENDER):
+        """Load an arbitrary position from [king, defender, attacker] masks."""
+        self._clear()
+        for piece, mask in enumerate(bitboards):
+            for sq in iter_bits(mask):
+                self._put(piece, sq)
+        self.current_player = current_player
+        self.game_over = False
+        self.winner = None
+        self.check_win_conditions()
+
+    def _on(self, mask, row, col):
+        return bool(1 << self.geo.square(row, col) & mask)
+
+    def is_castle(self, row, col):
+        return self._on(self.geo.castle_mask, row, col)
+
+    def is_throne(self, row, col):
+        return self._on(self.geo.throne_mask, row, col)
+
+    def is_edge(self, row, col):
+        return self._on(self.geo.edge_mask, row, col)
+
+    def is_corner(self, row, col):
+        return self._on(self.geo.corner_mask, row, col)
+
+    def is_escape(self, row, col):
+        """The king wins on this square (any edge on 9x9, the corners on larger boards)."""
+        return self._on(self.geo.escape_mask, row, col)
+
+    def is_restricted(self, row, col):
+        """Only the king may stop here (on 9x9 only the attackers are kept out)."""
+        return self._on(self.geo.restricted_mask, row, col)
+
+    # ------------------ MOVES ------------------
+    def legal_targets(self, sq):
+        """Mask of squares the piece on sq can move to."""
+        piece = self.piece_at(sq)
+        if piece is None:
+            return 0
+        # corners (and on the larger boards the castle) are reserved
+        geo = self.geo
+        return geo.sliding_moves(sq, self.occupied()) & geo.allowed_destinations[piece]
+
+    def generate_moves(self, side=None, out=None):
+        """Write every legal move for side (DEFENDER or ATTACKER) into out.
+
+        Moves are encoded as from_sq << MOVE_SHIFT | to_sq (see
+        bitboard.encode_move). out defaults to self.move_buffer, which is
+        overwritten by the next call. Returns the number of moves written.
+        """
+        if side is None:
+            side = self.current_player
+        if out is None:
+            out = self.move_buffer
+        bb = self.bitboards
+        occupied = bb[KING] | bb[DEFENDER] | bb[ATTACKER]
+        if side == ATTACKER:
+            own = bb[ATTACKER]
+        else:
+            own = bb[DEFENDER] | bb[KING]
+        geo = self.geo
+        side_allowed = geo.allowed_destinations[side]
+        # the king may also stop on restricted squares (corners, castle)
+        king_allowed = geo.allowed_destinations[KING]
+        king = bb[KING]
+        ray_squares = geo.ray_squares
+        square_bit = geo.square_bit
+        n = 0
+        while own:
+            low = own & -own
+            own ^= low
+            from_sq = low.bit_length() - 1
+            base = from_sq << MOVE_SHIFT
+            allowed = king_allowed if low & king else side_allowed
+            for ray in ray_squares[from_sq]:
+                for to_sq in ray:
+                    bit = square_bit[to_sq]
+                    if occupied & bit:
+                        break
+                    if allowed & bit:
+                        out[n] = base | to_sq
+                        n += 1
+        return n
+
+    def get_valid_moves(self, row, col):
+        return [divmod(t, self.size) for t in iter_bits(self.legal_targets(self.geo.square(row, col)))]
+
+    def make_move(self, from_sq, to_sq):
+        """Play an already-validated move and push what is needed to undo it.
+
+        Pure engine operation: no legality check, no turn_side or network
+        side effects. Toggles current_player.
+        """
+        bb = self.bitboards
+        piece = self.piece_at(from_sq)
+        victim = VICTIM[piece]
+        victims_before = bb[victim] if victim is not None else 0
+        king_before = self.king_sq
+        prev_game_over = self.game_over
+        prev_winner = self.winner
+        prev_player = self.current_player
+
+        self._remove(piece, from_sq)
+        self._put(piece, to_sq)
+        self._captures(to_sq)
+        self.check_win_conditions()
+
+        captured = victims_before ^ bb[victim] if victim is not None else 0
+        king_taken = king_before if self.king_sq is None and piece != KING else None
+        self.undo_stack.append((from_sq, to_sq, piece, captured, king_taken,
+                                prev_game_over, prev_winner, prev_player))
+
+        # Toggle numeric current_player for legacy UI compatibility
+        self.current_player = DEFENDER if prev_player == ATTACKER else ATTACKER
+        key = self.zobrist_hash()
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
+        if self.debug:
+            self.verify_state()
+
+    def unmake_move(self):
+        """Take back the last make_move, restoring captures and game state."""
+        (from_sq, to_sq, piece, captured, king_taken,
+         prev_game_over, prev_winner, prev_player) = self.undo_stack.pop()
+        key = self.zobrist_hash()
+        seen = self.position_counts[key] - 1
+        if seen:
+            self.position_counts[key] = seen
+        else:
+            del self.position_counts[key]
+        self._remove(piece, to_sq)
+        self._put(piece, from_sq)
+        if captured:
+            victim = VICTIM[piece]
+            for sq in iter_bits(captured):
+                self._put(victim, sq)
+        if king_taken is not None:
+            self._put(KING, king_taken)
+        self.game_over = prev_game_over
+        self.winner = prev_winner
+        self.current_player = prev_player
+
+    def move_piece(self, from_row, from_col, to_row, to_col, send=True):
+        geo = self.geo
+        if not (geo.in_bounds(from_row, from_col) and geo.in_bounds(to_row, to_col)):
+            return False
+        from_sq = geo.square(from_row, from_col)
+        to_sq = geo.square(to_row, to_col)
+        if not self.legal_targets(from_sq) & 1 << to_sq:
+            return False
+
+        self.make_move(from_sq, to_sq)
+
+        # Toggle network/local side turn tracker
+        if self.turn_side:
+            self.turn_side = "DEFENDER" if self.turn_side == "ATTACKER" else "ATTACKER"
+
+        if send and self.net:
+            self.net.send_json({"type": "move",
+                                "from": [from_row, from_col],
+                                "to": [to_row, to_col]})
+        return True
+
+    # ------------------ CAPTURES / WINS ------------------
+    def check_captures(self, row, col):
+        self._captures(self.geo.square(row, col))
+
+    def _captures(self, sq):
+        moving_piece = self.piece_at(sq)
+        bb = self.bitboards
+        # regular pieces are only taken by the opposite non-king type
+        victim = VICTIM[moving_piece]
+        geo = self.geo
+        # corners and the empty castle on the larger boards (bitboard.Geometry.hostile_mask)
+        anvil = bb[moving_piece] | geo.hostile_mask & ~bb[KING]
+        for target_sq, target_bit, beyond_bit in geo.capture_pairs[sq]:
+            if moving_piece != KING and bb[KING] & target_bit:
+                self._king_capture(target_sq)
+            elif victim is not None and bb[victim] & target_bit and anvil & beyond_bit:
+                self._remove(victim, target_sq)
+
+    def check_king_capture(self, king_row, king_col):
+        self._king_capture(self.geo.square(king_row, king_col))
+
+    def _king_capture(self, sq):
+        geo = self.geo
+        attackers = self.bitboards[ATTACKER]
+        around = geo.neighbour_mask[sq]
+        bit = 1 << sq
+        # Copenhagen (bitboard.SURROUND_KING): attackers or the empty castle on
+        # all four sides, never on the edge
+        if geo.surround_king:
+            hostile = attackers | geo.castle_mask
+            captured = around.bit_count() == 4 and around & hostile == around
+        # In-castle: 4 attackers
+        elif bit & geo.castle_mask:
+            captured = (around & attackers).bit_count() == 4
+        # Adjacent to castle: 3 attackers (castle counts if empty)
+        elif bit & geo.throne_mask:
+            captured = (around & (attackers | geo.castle_mask)).bit_count() >= 3
+        # Else: sandwiched by two attackers on opposite sides
+        else:
+            captured = any(attackers & pair == pair for pair in geo.king_pairs[sq])
+        if captured:
+            self._remove(KING, sq)
+            self.game_over = True
+            self.winner = ATTACKER
+
+    def check_win_conditions(self):
+        king_sq = self.king_sq
+        # King captured (handled elsewhere) -> confirm king presence
+        if king_sq is None:
+            self.game_over = True
+            self.winner = ATTACKER
+        # King escapes (an edge on 9x9, a corner on the larger boards)
+        elif 1 << king_sq & self.geo.escape_mask:
+            self.game_over = True
+            self.winner = DEFENDER
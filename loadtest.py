@@ -0,0 +1,415 @@
+# loadtest.py
+# Localhost load generator for relay_server.py.
+#
+#   python loadtest.py --spawn --rooms 200 --rate 5 --duration 30
+#   python loadtest.py --port 8765 --rooms 50 --churn 0.02 -o load.json
+#   python loadtest.py --spawn --shards 4 --rooms 500 --max-p99 50
+#
+# Every room gets two simulated players that join, wait for "start" and then
+# play random legal moves at --rate moves per second per room. End-to-end
+# latency is measured from the moment the mover writes its move to the
+# moment the opponent has read it (both ends live in this process, so they
+# share a clock). With --churn, a player about to move sometimes leaves and
+# rejoins the same room instead, which drives the relay's clean-up path
+# (opponent_left, waiting, a fresh start). With --drop it just cuts the
+# connection and resumes the game with its token and last seen sequence
+# number. With --forge the mover sometimes also sends a message only the
+# relay may send (a winning "state", "start", "evicted", ...); the relay has
+# to drop it, so the opponent never sees one. Finished games reconnect both
+# players to a new room. The report is JSON; exit code is 1 when --max-p99
+# is exceeded or players saw errors, desyncs or forged messages.
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from array import array
+
+from bitboard import DEFENDER, ATTACKER, MAX_MOVES, decode_move
+from engine import Hnefatafl, BOARD_SIZE, BOARD_SIZES
+from protocol import PROTO_JSON, PROTO_BIN, encode, read_message
+
+SIDE_CODES = {"DEFENDER": DEFENDER, "ATTACKER": ATTACKER}
+LOCALHOST = "127.0.0.1"
+# a player that hears nothing for this long gives up on the connection
+READ_TIMEOUT = 15.0
+# --forge sends one of these, tagged "forged": true, as if it came from the relay
+FORGED_MESSAGES = [
+    {"type": "state", "pos": [1, 0, 0], "turn": "ATTACKER", "game_over": True, "winner": "ATTACKER"},
+    {"type": "start", "your_side": "ATTACKER", "current_player": "ATTACKER"},
+    {"type": "resume", "seq": 0, "moves": []},
+    {"type": "evicted", "reason": "idle"},
+    {"type": "error", "msg": "forged"},
+]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []       # seconds, one per relayed move
+        self.moves = 0
+        self.games = 0
+        self.connects = 0
+        self.churns = 0
+        self.drops = 0
+        self.resumes = 0
+        self.opponent_left = 0
+        self.timeouts = 0
+        self.desyncs = 0
+        self.forged = 0           # relay-only messages sent by players
+        self.forged_seen = 0      # ... and how many reached the opponent
+        self.errors = {}          # relay error message -> count
+
+    def error(self, msg):
+        self.errors[msg] = self.errors.get(msg, 0) + 1
+
+
+class Room:
+    """What the two players of one room share: the code and the in-flight move."""
+
+    def __init__(self, index, run_id):
+        self.index = index
+        self.run_id = run_id
+        self.generation = 0
+        self.sent_at = None
+
+    @property
+    def code(self):
+        return f"load-{self.run_id}-{self.index}-{self.generation}"
+
+
+class Player:
+    def __init__(self, name, binary, size=BOARD_SIZE):
+        self.name = name
+        self.binary = binary
+        self.size = size
+        self.reader = self.writer = None
+        self.proto = PROTO_JSON
+        self.side = None
+        # game in progress; kept across a dropped connection so it can resume
+        self.game = None
+        self.game_id = None
+        self.token = None
+        self.seq = 0              # moves of this game seen or sent
+        self.resuming = False     # sent a resume join, no answer yet
+        self.rejected = False     # the next state snapshot corrects a refused move
+        # A state snapshot can be one move behind: the relay queued it before
+        # our last move reached it. Remember the position we moved from to
+        # tell a stale snapshot from a real desync.
+        self.before_move = None
+
+    async def connect(self, host, port, room_code, resume=False):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.proto = PROTO_JSON
+        hello = {"type": "join", "room": room_code, "name": self.name, "size": self.size}
+        if self.binary:
+            hello["protocols"] = [PROTO_BIN]
+        self.resuming = resume
+        if resume:
+            hello["resume"] = {"game": self.game_id, "token": self.token, "seq": self.seq}
+        self.writer.write(encode(hello, PROTO_JSON))
+        await self.writer.drain()
+
+    async def recv(self, timeout=READ_TIMEOUT):
+        msg = await asyncio.wait_for(read_message(self.reader, self.proto), timeout)
+        if msg is not None and msg.get("type") == "proto":
+            self.proto = msg.get("mode", PROTO_JSON)
+        return msg
+
+    async def send(self, obj):
+        self.writer.write(encode(obj, self.proto))
+        await self.writer.drain()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self.writer = None
+
+
+async def play(player, room, stats, args, rnd, deadline):
+    """One simulated client: connect, play until the game ends, repeat."""
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    buf = array("I", bytes(4 * MAX_MOVES))
+    generation = room.generation
+    resume = False
+
+    while time.monotonic() < deadline:
+        room_code = room.code
+        try:
+            await player.connect(args.host, args.port, room_code, resume)
+            stats.connects += 1
+            outcome = await _play_connection(player, room, stats, args, rnd, deadline, interval, buf)
+        except asyncio.TimeoutError:
+            if time.monotonic() < deadline:
+                stats.timeouts += 1
+            outcome = None
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            stats.error("connection lost")
+            outcome = None
+        await player.close()
+        resume = outcome == "drop"
+        if not resume:
+            player.game = None
+        if outcome == "churn":
+            await asyncio.sleep(rnd.uniform(0.0, args.rejoin_delay))
+        elif outcome is None and room.generation == generation:
+            # game over (or a lost connection): both players move on to a fresh room
+            room.generation += 1
+        generation = room.generation
+
+
+def _game_done(player, stats, args):
+    if player.game.game_over or player.seq >= args.max_plies:
+        if player.side == ATTACKER:
+            stats.games += 1
+        return True
+    return False
+
+
+async def _play_connection(player, room, stats, args, rnd, deadline, interval, buf):
+    """Play over one connection.
+
+    Returns "churn" when the player left on purpose, "drop" when it cut the
+    link to resume later, None when the game is over or the link failed.
+    """
+    while time.monotonic() < deadline:
+        msg = await player.recv(min(READ_TIMEOUT, deadline - time.monotonic() + 0.5))
+        if msg is None:
+            return None
+        if msg.get("forged"):
+            stats.forged_seen += 1
+            continue
+        mtype = msg.get("type")
+        game = player.game
+        if mtype == "start":
+            game = player.game = Hnefatafl(size=msg.get("size", BOARD_SIZE))
+            game.current_player = SIDE_CODES[msg["current_player"]]
+            player.side = SIDE_CODES[msg["your_side"]]
+            player.game_id, player.token = msg.get("game"), msg.get("token")
+            player.seq = 0
+            player.before_move = None
+        elif mtype == "move" and game is not None:
+            if room.sent_at is not None:
+                stats.latencies.append(time.perf_counter() - room.sent_at)
+                room.sent_at = None
+            (fr, fc), (tr, tc) = msg["from"], msg["to"]
+            game.make_move(game.geo.square(fr, fc), game.geo.square(tr, tc))
+            player.seq += 1
+        elif mtype == "resume" and game is not None:
+            stats.resumes += 1
+            # moves that arrive this way don't count towards latency
+            room.sent_at = None
+            for fr, fc, tr, tc in msg["moves"]:
+                game.make_move(game.geo.square(fr, fc), game.geo.square(tr, tc))
+            player.seq = msg["seq"]
+            player.resuming = False
+        elif mtype == "resume_failed":
+            stats.error("resume failed")
+            return None
+        elif mtype == "state" and game is not None:
+            snapshot = (msg["pos"], SIDE_CODES[msg["turn"]])
+            if snapshot != (list(game.bitboards), game.current_player) and snapshot != player.before_move:
+                stats.desyncs += 1
+                game.set_position(*snapshot)
+            # a snapshot may predate our last move; only a refused move winds seq back
+            seq = msg.get("seq", player.seq)
+            player.seq = seq if player.rejected else max(seq, player.seq)
+            player.rejected = False
+        elif mtype == "opponent_left":
+            stats.opponent_left += 1
+            game = player.game = None
+        elif mtype == "error":
+            stats.error(msg.get("msg", "?"))
+            player.rejected = True
+        elif mtype == "full":
+            stats.error("room full")
+            return None
+
+        if game is None or player.resuming:
+            continue
+        if _game_done(player, stats, args):
+            return None
+        if game.current_player != player.side:
+            continue
+
+        # our move
+        if interval:
+            await asyncio.sleep(interval)
+        if args.forge and rnd.random() < args.forge:
+            stats.forged += 1
+            await player.send(dict(rnd.choice(FORGED_MESSAGES), forged=True))
+        if args.churn and rnd.random() < args.churn:
+            stats.churns += 1
+            await player.send({"type": "leave"})
+            return "churn"
+        if args.drop and rnd.random() < args.drop:
+            stats.drops += 1
+            return "drop"
+        n = game.generate_moves(player.side, buf)
+        if not n:
+            return None
+        from_sq, to_sq = decode_move(buf[rnd.randrange(n)])
+        player.before_move = (list(game.bitboards), game.current_player)
+        game.make_move(from_sq, to_sq)
+        player.seq += 1
+        room.sent_at = time.perf_counter()
+        await player.send({"type": "move", "from": list(divmod(from_sq, game.size)),
+                           "to": list(divmod(to_sq, game.size))})
+        stats.moves += 1
+        if _game_done(player, stats, args):
+            return None
+    return None
+
+
+# ------------------ RELAY PROCESS ------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind((LOCALHOST, 0))
+        return s.getsockname()[1]
+
+
+def spawn_relay(port, shards, workdir):
+    """Start relay_server.py in workdir (its move logs end up there)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "relay_server.py"),
+                             "--host", LOCALHOST, "--port", str(port),
+                             "--shards", str(shards), "--metrics-port", "0"],
+                            stdout=subprocess.DEVNULL, cwd=workdir)
+    for _ in range(100):
+        try:
+            socket.create_connection((LOCALHOST, port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.terminate()
+    raise RuntimeError("relay did not start")
+
+
+# ------------------ REPORT ------------------
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def report(stats, args, elapsed):
+    lat = sorted(stats.latencies)
+
+    def ms(v):
+        return None if v is None else round(v * 1000, 3)
+
+    return {
+        "rooms": args.rooms,
+        "rate": args.rate,
+        "churn": args.churn,
+        "drop": args.drop,
+        "binary": not args.json,
+        "size": args.size,
+        "seconds": round(elapsed, 3),
+        "moves": stats.moves,
+        "moves_per_second": round(stats.moves / elapsed, 1) if elapsed else 0,
+        "latency_ms": {"p50": ms(percentile(lat, 0.50)), "p90": ms(percentile(lat, 0.90)),
+                       "p99": ms(percentile(lat, 0.99)), "max": ms(lat[-1] if lat else None),
+                       "samples": len(lat)},
+        "games": stats.games,
+        "connects": stats.connects,
+        "churns": stats.churns,
+        "drops": stats.drops,
+        "resumes": stats.resumes,
+        "opponent_left": stats.opponent_left,
+        "timeouts": stats.timeouts,
+        "desyncs": stats.desyncs,
+        "forged": stats.forged,
+        "forged_seen": stats.forged_seen,
+        "errors": stats.errors,
+    }
+
+
+async def run(args):
+    stats = Stats()
+    run_id = f"{os.getpid()}{int(time.time()) % 100000}"
+    rooms = [Room(i, run_id) for i in range(args.rooms)]
+    deadline = time.monotonic() + args.duration
+    tasks = []
+    for room in rooms:
+        for k in ("a", "b"):
+            rnd = random.Random(f"{args.seed}-{room.index}-{k}")
+            player = Player(f"load{room.index}{k}", binary=not args.json, size=args.size)
+            tasks.append(asyncio.create_task(play(player, room, stats, args, rnd, deadline)))
+    start = time.monotonic()
+    await asyncio.gather(*tasks)
+    return report(stats, args, time.monotonic() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Localhost load generator for the relay server")
+    parser.add_argument("--host", default=LOCALHOST)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a relay on a free local port for the run")
+    parser.add_argument("--shards", type=int, default=1, help="relay shards when using --spawn")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=2.0, help="moves per second per room")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--max-plies", type=int, default=200, help="start a new game after this many plies")
+    parser.add_argument("--churn", type=float, default=0.0,
+                        help="chance per turn that the mover disconnects and rejoins instead")
+    parser.add_argument("--drop", type=float, default=0.0,
+                        help="chance per turn that the mover cuts the link and resumes the game")
+    parser.add_argument("--forge", type=float, default=0.0,
+                        help="chance per turn that the mover also sends a relay-only message")
+    parser.add_argument("--rejoin-delay", type=float, default=0.5, help="max seconds before a churned player rejoins")
+    parser.add_argument("--json", action="store_true", help="speak JSON lines instead of binary frames")
+    parser.add_argument("--size", type=int, choices=BOARD_SIZES, default=BOARD_SIZE,
+                        help=f"board size every room plays on (default {BOARD_SIZE})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p99", type=float, default=None, help="fail when p99 latency exceeds this (ms)")
+    parser.add_argument("-o", "--output", help="write the JSON report here as well")
+    args = parser.parse_args(argv)
+
+    if args.host not in (LOCALHOST, "localhost", "::1"):
+        parser.error("the load tester only targets a relay on this machine")
+
+    relay = None
+    workdir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    if args.spawn:
+        args.port = free_port()
+        relay = spawn_relay(args.port, args.shards, workdir.name)
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if relay is not None:
+            relay.terminate()
+            relay.wait()
+        workdir.cleanup()
+
+    failed = []
+    p99 = result["latency_ms"]["p99"]
+    if args.max_p99 is not None and p99 is not None and p99 > args.max_p99:
+        failed.append(f"p99 latency {p99} ms over {args.max_p99} ms")
+    if result["desyncs"]:
+        failed.append(f"{result['desyncs']} state snapshots disagreed with the local board")
+    if result["forged_seen"]:
+        failed.append(f"{result['forged_seen']} forged relay messages reached the opponent")
+    if result["errors"]:
+        failed.append(f"relay errors: {result['errors']}")
+    result["problems"] = failed
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
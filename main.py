@@ -3,19 +3,32 @@ import pygame
 import sys
 import socket
 import threading
-import json
 import queue
 import time
+import logging
+import collections
 
+from engine import Hnefatafl, BOARD_SIZE, BOARD_SIZES, KING, DEFENDER, ATTACKER
+from protocol import PROTO_JSON, PROTO_BIN, StreamDecoder, encode
+from search import AIPlayer
+from bitboard import iter_bits, geometry
 
 # ------------------ WINDOW / PYGAME ------------------
 WIDTH = 900
 HEIGHT = 900
 
-pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-clock = pygame.time.Clock()
-pygame.display.set_caption("Hnefatafl, NOT FALAFEL")
+# created by init_display() when main() runs, so importing this module
+# never opens a window
+screen = None
+clock = None
+
+
+def init_display():
+    global screen, clock
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    clock = pygame.time.Clock()
+    pygame.display.set_caption("Hnefatafl, NOT FALAFEL")
 
 # ------------------ COLORS ------------------
 BLACK = (0, 0, 0)
@@ -29,317 +42,346 @@ LIGHT_GRAY = (200, 200, 200)
 YELLOW = (255, 255, 0)
 
 # ------------------ GAME CONST ------------------
-BOARD_SIZE = 9
-CELL_SIZE = WIDTH // BOARD_SIZE
-KING = 0
-DEFENDER = 1
-ATTACKER = 2
+# board sizes offered by the start menu, with the variant each one plays
+# (the capture rules for each are described above bitboard.SURROUND_KING)
+SIZE_LABELS = {9: "9x9 (Edge escape)", 11: "11x11 (Copenhagen)", 13: "13x13 (Corner escape)",
+               19: "19x19 (Alea Evangelii)"}
 
 # ------------------ NETWORK CONFIG ------------------
 SERVER_HOST = "100.76.152.128"
 SERVER_PORT = 8765
+USE_BINARY_PROTOCOL = True   # offer compact binary frames; the relay may still answer in JSON
+RESUME_TIMEOUT = 60.0        # keep redialling a dropped game this long (the relay holds the slot as long)
+RELAY_TIMEOUT = 45.0         # the relay pings idle links every 15s; this much silence means the link is dead
+PING_INTERVAL = 5.0          # seconds between our own timestamped pings
+PING_WINDOW = 8              # the clock offset comes from the best of this many samples
+NET_LOG = "netstats.log"     # one CSV line per pong (None disables)
+
+# ------------------ FRAME PACING ------------------
+ACTIVE_FPS = 60        # frame rate while the player is interacting
+ACTIVE_LINGER = 0.5    # seconds of full frame rate after the last input event
+IDLE_WAKE_MS = 1000    # an idle loop still wakes up this often
+# posted by the network and AI threads to wake an idle main loop
+WAKE_EVENT = pygame.event.custom_type()
+INPUT_EVENTS = (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION,
+                pygame.KEYDOWN, pygame.KEYUP)
+
+# ------------------ AI CONFIG ------------------
+AI_TIME_BUDGET = 2.0   # seconds of search per computer move
+AI_DEBUG_LOG = False   # log every computer move's search stats (score, nodes, nps) to stderr
+
+log = logging.getLogger("hnefatafl")
 
 # =====================================================
 #                       NETWORK
 # =====================================================
+class LinkStats:
+    """Round-trip time, jitter and clock offset to the relay.
+
+    rtt and jitter are smoothed with TCP's gains (RFC 6298: 1/8 and 1/4).
+    The offset (relay clock minus ours) is taken from the fastest of the
+    last PING_WINDOW round trips, the one queueing distorted least.
+    """
+
+    def __init__(self, log_path=None, peer=""):
+        self.rtt = None
+        self.jitter = None
+        self.offset = None
+        self.samples = collections.deque(maxlen=PING_WINDOW)   # (rtt, offset)
+        self.peer = peer
+        self.log = None
+        if log_path:
+            try:
+                self.log = open(log_path, "a", buffering=1)
+                if self.log.tell() == 0:
+                    self.log.write("time,relay,rtt_ms,srtt_ms,jitter_ms,offset_ms\n")
+            except OSError:
+                self.log = None
+
+    def sample(self, rtt, offset=None):
+        if self.rtt is None:
+            self.rtt, self.jitter = rtt, rtt / 2
+        else:
+            self.jitter += (abs(self.rtt - rtt) - self.jitter) / 4
+            self.rtt += (rtt - self.rtt) / 8
+        if offset is not None:
+            self.samples.append((rtt, offset))
+            self.offset = min(self.samples)[1]
+        if self.log:
+            off = "" if self.offset is None else f"{self.offset * 1000:.1f}"
+            self.log.write(f"{time.time():.3f},{self.peer},{rtt * 1000:.1f},"
+                           f"{self.rtt * 1000:.1f},{self.jitter * 1000:.1f},{off}\n")
+
+    def __str__(self):
+        if self.rtt is None:
+            return ""
+        text = f"RTT {self.rtt * 1000:.0f}\u00b1{self.jitter * 1000:.0f}ms"
+        if self.offset is not None:
+            text += f" offset {self.offset * 1000:+.0f}ms"
+        return text
+
 class NetClient:
-    def __init__(self, host, port, room_code, nickname):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(3)  # ⏱️ 3 seconds max wait
-        try:
-            self.sock.connect((host, port))
-        except socket.timeout:
-            raise ConnectionError(f"Connection to {host}:{port} timed out.")
-        except Exception as e:
-            raise ConnectionError(f"Failed to connect: {e}")
-        self.sock.settimeout(None)  # back to blocking for normal use
-        self.sock_lock = threading.Lock()
+    def __init__(self, host, port, room_code, nickname, binary=USE_BINARY_PROTOCOL, on_message=None,
+                 size=BOARD_SIZE):
+        self.host = host
+        self.port = port
+        # board size we ask for; the relay only pairs us with a room of that size
+        self.size = size
+        # called from the listener thread after each inbox.put()
+        self.on_message = on_message
+        # None asks the relay for a quickmatch; it answers with the room it picked
+        self.room_code = None if room_code is None else str(room_code)
+        self.nickname = nickname
+        self.binary = binary
+        # from "start": lets us take our seat back after a dropped link.
+        # seq counts the moves of the current game we have seen or sent.
+        self.game_id = None
+        self.token = None
+        self.seq = 0
+        self._rejected = False
+        # RLock: _reconnect swaps the socket and sends the join under it
+        self.sock_lock = threading.RLock()
+        # lists of messages, one per socket read, so a burst costs the UI one get()
         self.inbox = queue.Queue()
         self.alive = True
+        self.link = LinkStats(NET_LOG, f"{host}:{port}")
+        self._ping = None   # (id, monotonic, wall clock) of the ping in flight
+        self._stopped = threading.Event()
+        # set once the relay has answered our join, i.e. the framing is settled
+        self._negotiated = threading.Event()
+        self.sock = self._connect()
 
         # Join room with name
-        self.send_json({"type": "join", "room": str(room_code), "name": nickname})
+        self._join()
 
         # Listener thread
         self.t = threading.Thread(target=self._recv_loop, daemon=True)
         self.t.start()
+        threading.Thread(target=self._ping_loop, daemon=True).start()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(3)  # ⏱️ 3 seconds max wait
+        try:
+            sock.connect((self.host, self.port))
+        except socket.timeout:
+            raise ConnectionError(f"Connection to {self.host}:{self.port} timed out.")
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect: {e}")
+        # recv() times out only if even the relay's heartbeats stop coming
+        sock.settimeout(RELAY_TIMEOUT)
+        return sock
+
+    def _join(self, resume=False):
+        # stays JSON until the relay acknowledges binary framing
+        self.proto = PROTO_JSON
+        self.decoder = StreamDecoder()
+        # Offering binary: the relay switches to reading frames right after
+        # our join, so nothing else may be sent until we know which way it
+        # went (its "proto" ack, or any other first message for JSON).
+        if self.binary:
+            self._negotiated.clear()
+        else:
+            self._negotiated.set()
+        if self.room_code is None:
+            join = {"type": "quickmatch", "name": self.nickname, "size": self.size}
+        else:
+            join = {"type": "join", "room": self.room_code, "name": self.nickname, "size": self.size}
+        if self.binary:
+            join["protocols"] = [PROTO_BIN]
+        if resume:
+            join["resume"] = {"game": self.game_id, "token": self.token, "seq": self.seq}
+        self.send_json(join)
 
     def send_json(self, obj):
-        data = (json.dumps(obj) + "\n").encode("utf-8")
         with self.sock_lock:
+            if obj.get("type") not in ("join", "quickmatch") and not self._negotiated.is_set():
+                # still waiting for the answer to our join (see _join)
+                return
+            data = encode(obj, self.proto)
+            if obj.get("type") == "move":
+                self.seq += 1
             try:
                 self.sock.sendall(data)
             except Exception:
                 pass
 
+    def _track(self, obj):
+        mtype = obj.get("type")
+        if mtype == "room":
+            self.room_code = obj.get("room")
+        elif mtype == "start":
+            self.game_id, self.token, self.seq = obj.get("game"), obj.get("token"), 0
+        elif mtype == "move":
+            self.seq += 1
+        elif mtype == "resume":
+            self.seq = obj.get("seq", self.seq)
+        elif mtype == "error":
+            self._rejected = True
+        elif mtype == "evicted":
+            # the room is gone, there is nothing to resume
+            self.game_id = None
+        elif mtype == "state":
+            # a snapshot may predate our own last move; only one sent after
+            # a refused move may wind the count back
+            seq = obj.get("seq", self.seq)
+            self.seq = seq if self._rejected else max(seq, self.seq)
+            self._rejected = False
+
+    def _post(self, batch):
+        self.inbox.put(batch)
+        if self.on_message:
+            self.on_message()
+
     def _recv_loop(self):
-        buff = b""
         while self.alive:
             try:
-                chunk = self.sock.recv(4096)
-                if not chunk:
-                    break
-                buff += chunk
-                while b"\n" in buff:
-                    line, buff = buff.split(b"\n", 1)
-                    try:
-                        obj = json.loads(line.decode("utf-8").strip())
-                        self.inbox.put(obj)
-                    except Exception:
-                        pass
+                batch = []
+                for obj in self.decoder.recv_from(self.sock):
+                    if obj.get("type") == "proto":
+                        # relay accepted binary framing; send that way from now on
+                        self.proto = self.decoder.proto
+                        self._negotiated.set()
+                        continue
+                    # any other first answer means the relay stays on JSON
+                    self._negotiated.set()
+                    if obj.get("type") == "ping":
+                        self.send_json({"type": "pong", "t": obj.get("t")})
+                        continue
+                    if obj.get("type") == "pong":
+                        self._on_pong(obj)
+                        continue
+                    self._track(obj)
+                    batch.append(obj)
+                if batch:
+                    self._post(batch)
             except Exception:
-                break
+                if not (self.alive and self._reconnect()):
+                    break
         self.alive = False
+        self._stopped.set()
+
+    def _ping_loop(self):
+        n = 0
+        while not self._stopped.wait(PING_INTERVAL):
+            if not self._negotiated.is_set():
+                # (re)joining: a ping now could go out in the wrong framing
+                continue
+            n += 1
+            # a ping still unanswered by now is forgotten
+            self._ping = (n, time.monotonic(), time.time())
+            self.send_json({"type": "ping", "n": n, "t": self._ping[2]})
+
+    def _on_pong(self, obj):
+        ping = self._ping
+        if ping is None or obj.get("n") != ping[0]:
+            return
+        self._ping = None
+        rtt = time.monotonic() - ping[1]
+        st = obj.get("st")
+        # the relay stamped st about halfway through the round trip
+        offset = st - (ping[2] + rtt / 2) if isinstance(st, (int, float)) else None
+        self.link.sample(rtt, offset)
+        if self.on_message:
+            self.on_message()   # redraw the status line
+
+    def _reconnect(self):
+        """Dial back in after a dropped link and resume the game in progress."""
+        if self.game_id is None:
+            return False
+        self._post([{"type": "reconnecting"}])
+        deadline = time.time() + RESUME_TIMEOUT
+        delay = 0.5
+        while self.alive and time.time() < deadline:
+            time.sleep(delay)
+            try:
+                sock = self._connect()
+            except ConnectionError:
+                delay = min(delay * 2, 5.0)
+                continue
+            # nothing may be sent between the swap and the join (see _join)
+            with self.sock_lock:
+                old, self.sock = self.sock, sock
+                self._join(resume=True)
+            try:
+                old.close()
+            except Exception:
+                pass
+            return True
+        return False
 
     def close(self):
+        # a real goodbye, so the relay frees the seat instead of holding it
+        self.send_json({"type": "leave"})
         self.alive = False
+        self._stopped.set()
         try:
+            self.sock.shutdown(socket.SHUT_RDWR)
             self.sock.close()
         except Exception:
             pass
 
+def apply_server_state(game, msg):
+    """Replace the local position with the relay's authoritative snapshot."""
+    king, defenders, attackers = msg["pos"]
+    turn = msg.get("turn", "ATTACKER")
+    game.set_position([king, defenders, attackers], ATTACKER if turn == "ATTACKER" else DEFENDER)
+    game.turn_side = turn
+    if msg.get("game_over"):
+        game.game_over = True
+        game.winner = ATTACKER if msg.get("winner") == "ATTACKER" else DEFENDER
+    game.selected_piece = None
+
 # =====================================================
-#                       GAME LOGIC
+#                   FRAME PACING
 # =====================================================
-class Hnefatafl:
-    def __init__(self):
-        self.board = [[None for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
-        self.selected_piece = None
-        self.current_player = DEFENDER
-        self.game_over = False
-        self.winner = None
-        self.setup_board()
-
-        # Multiplayer / mode fields
-        self.my_side = None        # "DEFENDER", "ATTACKER", or "LOCAL"
-        self.turn_side = None      # "DEFENDER" or "ATTACKER"
-        self.my_name = None
-        self.opponent_name = None
-        self.waiting = True        # lobby/wait state
-        self.net = None
-
-    def setup_board(self):
-        for row in range(BOARD_SIZE):
-            for col in range(BOARD_SIZE):
-                self.board[row][col] = None
-
-        center = BOARD_SIZE // 2
-        self.board[center][center] = KING
-
-        # defenders around king
-        self.board[center-1][center] = DEFENDER
-        self.board[center+1][center] = DEFENDER
-        self.board[center][center-1] = DEFENDER
-        self.board[center][center+1] = DEFENDER
-        self.board[center-1][center-1] = DEFENDER
-        self.board[center-1][center+1] = DEFENDER
-        self.board[center+1][center-1] = DEFENDER
-        self.board[center+1][center+1] = DEFENDER
-
-        edge_positions = [
-            (0, center), (BOARD_SIZE-1, center),
-            (center, 0), (center, BOARD_SIZE-1)
-        ]
-        for row, col in edge_positions:
-            offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-            for dr, dc in offsets:
-                new_row, new_col = row + dr, col + dc
-                if 0 <= new_row < BOARD_SIZE and 0 <= new_col < BOARD_SIZE:
-                    if self.board[new_row][new_col] is None:
-                        self.board[new_row][new_col] = ATTACKER
-
-    def is_castle(self, row, col):
-        return row == BOARD_SIZE // 2 and col == BOARD_SIZE // 2
-
-    def is_throne(self, row, col):
-        center = BOARD_SIZE // 2
-        return (row == center and col == center) or \
-               (row == center-1 and col == center) or \
-               (row == center+1 and col == center) or \
-               (row == center and col == center-1) or \
-               (row == center and col == center+1)
-
-    def is_edge(self, row, col):
-        return row == 0 or row == BOARD_SIZE-1 or col == 0 or col == BOARD_SIZE-1
-
-    def is_corner(self, row, col):
-        return (row, col) in [(0,0), (0, BOARD_SIZE-1), (BOARD_SIZE-1, 0), (BOARD_SIZE-1, BOARD_SIZE-1)]
-
-    def get_valid_moves(self, row, col):
-        if self.board[row][col] is None:
-            return []
-        piece_type = self.board[row][col]
-        valid_moves = []
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        for dr, dc in directions:
-            for distance in range(1, BOARD_SIZE):
-                new_row, new_col = row + dr * distance, col + dc * distance
-                if not (0 <= new_row < BOARD_SIZE and 0 <= new_col < BOARD_SIZE):
-                    break
-                # attackers cannot move into corners (reserved)
-                if piece_type == ATTACKER and self.is_corner(new_row, new_col):
-                    continue
-                # blocked by piece
-                if self.board[new_row][new_col] is not None:
-                    break
-                # king can move onto edges (escape)
-                if piece_type == KING and self.is_edge(new_row, new_col):
-                    valid_moves.append((new_row, new_col))
-                    continue
-                valid_moves.append((new_row, new_col))
-        return valid_moves
-
-    def move_piece(self, from_row, from_col, to_row, to_col, send=True):
-        if (to_row, to_col) not in self.get_valid_moves(from_row, from_col):
-            return False
-
-        piece_type = self.board[from_row][from_col]
-        self.board[from_row][from_col] = None
-        self.board[to_row][to_col] = piece_type
+def post_wake():
+    """Wake the main loop out of FrameScheduler.events(); safe from any thread."""
+    try:
+        pygame.event.post(pygame.event.Event(WAKE_EVENT))
+    except pygame.error:
+        pass   # display gone (shutting down) or event queue full
+
+class FrameScheduler:
+    """Paces the main loop.
+
+    While the player is interacting (an input event within ACTIVE_LINGER)
+    the loop runs at ACTIVE_FPS. Otherwise events() sleeps in
+    pygame.event.wait() until input arrives, another thread posts
+    WAKE_EVENT, or IDLE_WAKE_MS passes, so a client sitting in a lobby or
+    on a static board uses next to no CPU.
+    """
 
-        self.check_captures(to_row, to_col)
-        self.check_win_conditions()
-
-        # Toggle numeric current_player for legacy UI compatibility
-        self.current_player = DEFENDER if self.current_player == ATTACKER else ATTACKER
-
-        # Toggle network/local side turn tracker
-        if self.turn_side:
-            self.turn_side = "DEFENDER" if self.turn_side == "ATTACKER" else "ATTACKER"
-
-        if send and self.net:
-            self.net.send_json({"type": "move",
-                                "from": [from_row, from_col],
-                                "to": [to_row, to_col]})
-        return True
+    def __init__(self):
+        self.active_until = 0.0
 
-    def check_captures(self, row, col):
-        moving_piece = self.board[row][col]
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        for dr, dc in directions:
-            target_row, target_col = row + dr, col + dc
-            if not (0 <= target_row < BOARD_SIZE and 0 <= target_col < BOARD_SIZE):
-                continue
-            target_piece = self.board[target_row][target_col]
-            if target_piece is None or target_piece == moving_piece:
-                continue
-            opposite_row, opposite_col = target_row + dr, target_col + dc
-            if not (0 <= opposite_row < BOARD_SIZE and 0 <= opposite_col < BOARD_SIZE):
-                continue
-            opposite_piece = self.board[opposite_row][opposite_col]
-            if target_piece == KING:
-                self.check_king_capture(target_row, target_col)
-            elif opposite_piece == moving_piece:
-                self.board[target_row][target_col] = None
-
-    def check_king_capture(self, king_row, king_col):
-        # In-castle: 4 attackers
-        if self.is_castle(king_row, king_col):
-            directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-            attackers_count = 0
-            for dr, dc in directions:
-                adj_row, adj_col = king_row + dr, king_col + dc
-                if (0 <= adj_row < BOARD_SIZE and 0 <= adj_col < BOARD_SIZE and 
-                    self.board[adj_row][adj_col] == ATTACKER):
-                    attackers_count += 1
-            if attackers_count == 4:
-                self.board[king_row][king_col] = None
-                self.game_over = True
-                self.winner = ATTACKER
-        # Adjacent to castle: 3 attackers (castle counts if empty)
-        elif self.is_throne(king_row, king_col):
-            directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-            attackers_count = 0
-            for dr, dc in directions:
-                adj_row, adj_col = king_row + dr, king_col + dc
-                if (0 <= adj_row < BOARD_SIZE and 0 <= adj_col < BOARD_SIZE):
-                    if self.board[adj_row][adj_col] == ATTACKER:
-                        attackers_count += 1
-                    elif self.is_castle(adj_row, adj_col):
-                        attackers_count += 1
-            if attackers_count >= 3:
-                self.board[king_row][king_col] = None
-                self.game_over = True
-                self.winner = ATTACKER
-        # Else: sandwiched by two attackers on opposite sides
+    def events(self):
+        """Wait for the next frame and return the events that arrived meanwhile."""
+        if time.monotonic() < self.active_until:
+            clock.tick(ACTIVE_FPS)
+            events = pygame.event.get()
         else:
-            directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-            for dr, dc in directions:
-                adj_row, adj_col = king_row + dr, king_col + dc
-                opp_row, opp_col = king_row - dr, king_col - dc
-                if (0 <= adj_row < BOARD_SIZE and 0 <= adj_col < BOARD_SIZE and
-                    0 <= opp_row < BOARD_SIZE and 0 <= opp_col < BOARD_SIZE):
-                    if (self.board[adj_row][adj_col] == ATTACKER and 
-                        self.board[opp_row][opp_col] == ATTACKER):
-                        self.board[king_row][king_col] = None
-                        self.game_over = True
-                        self.winner = ATTACKER
-                        break
-
-    def check_win_conditions(self):
-        # King escapes to an edge
-        for row in range(BOARD_SIZE):
-            for col in range(BOARD_SIZE):
-                if self.board[row][col] == KING and self.is_edge(row, col):
-                    self.game_over = True
-                    self.winner = DEFENDER
-                    return
-        # King captured (handled elsewhere) -> confirm king presence
-        king_exists = any(self.board[row][col] == KING 
-                          for row in range(BOARD_SIZE) for col in range(BOARD_SIZE))
-        if not king_exists:
-            self.game_over = True
-            self.winner = ATTACKER
+            first = pygame.event.wait(IDLE_WAKE_MS)
+            events = pygame.event.get()
+            if first.type != pygame.NOEVENT:
+                events.insert(0, first)
+        if any(event.type in INPUT_EVENTS for event in events):
+            self.active_until = time.monotonic() + ACTIVE_LINGER
+        return events
 
 # =====================================================
 #                   RENDERING / UI
 # =====================================================
-def draw_board(game, status_msg=None):
-    screen.fill(BROWN)
-
-    # grid
-    for row in range(BOARD_SIZE + 1):
-        pygame.draw.line(screen, BLACK, (0, row * CELL_SIZE), (WIDTH, row * CELL_SIZE), 2)
-        pygame.draw.line(screen, BLACK, (row * CELL_SIZE, 0), (row * CELL_SIZE, HEIGHT), 2)
-
-    # castle + throne
-    center = BOARD_SIZE // 2
-    castle_rect = pygame.Rect(center * CELL_SIZE, center * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-    pygame.draw.rect(screen, (200, 200, 200), castle_rect)
-
-    throne_positions = [(center-1, center), (center+1, center), (center, center-1), (center, center+1)]
-    for r, c in throne_positions:
-        throne_rect = pygame.Rect(c * CELL_SIZE, r * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-        pygame.draw.rect(screen, (220, 220, 220), throne_rect)
-
-    # pieces
-    for row in range(BOARD_SIZE):
-        for col in range(BOARD_SIZE):
-            piece = game.board[row][col]
-            cx = col * CELL_SIZE + CELL_SIZE // 2
-            cy = row * CELL_SIZE + CELL_SIZE // 2
-            radius = CELL_SIZE // 3
-            if piece == KING:
-                pygame.draw.circle(screen, GOLD, (cx, cy), radius)
-                pygame.draw.circle(screen, BLACK, (cx, cy), radius, 2)
-            elif piece == DEFENDER:
-                pygame.draw.circle(screen, WHITE, (cx, cy), radius)
-                pygame.draw.circle(screen, BLACK, (cx, cy), radius, 2)
-            elif piece == ATTACKER:
-                pygame.draw.circle(screen, RED, (cx, cy), radius)
-                pygame.draw.circle(screen, BLACK, (cx, cy), radius, 2)
-
-    # selected & valid moves
-    if game.selected_piece:
-        row, col = game.selected_piece
-        highlight_rect = pygame.Rect(col * CELL_SIZE, row * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-        pygame.draw.rect(screen, YELLOW, highlight_rect, 3)
-        for mr, mc in game.get_valid_moves(row, col):
-            move_rect = pygame.Rect(mc * CELL_SIZE, mr * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-            pygame.draw.rect(screen, (0, 255, 0), move_rect, 2)
-
-    # status line
-    font = pygame.font.Font(None, 36)
+_fonts = {}
+
+def ui_font(size):
+    """Default font at size, created once (Font() loads the file every call)."""
+    if size not in _fonts:
+        _fonts[size] = pygame.font.Font(None, size)
+    return _fonts[size]
+
+def status_line(game, status_msg=None):
+    """(text, color) for the line drawn over the top of the board."""
     line = None
     color = GREEN
     if game.game_over:
@@ -363,14 +405,156 @@ def draw_board(game, status_msg=None):
 
     if status_msg:
         line = (line + " | " + status_msg) if line else status_msg
-
-    if line:
-        text = font.render(line, True, color)
-        screen.blit(text, (WIDTH // 2 - text.get_width() // 2, 20))
+    link = str(game.net.link) if game.net else ""
+    if link:
+        line = (line + " | " + link) if line else link
+    return line, color
+
+class BoardRenderer:
+    """Draws the board to a surface, repainting only the squares that changed.
+
+    The board's size comes from its Geometry; squares are WIDTH // size
+    pixels. The grid, castle, throne and corner squares are rendered once into a background
+    surface and each piece once into a sprite. draw() compares the position,
+    the selection highlights and the status text with what it drew last time
+    and repaints just those squares (background, piece, highlight, then the
+    status text clipped to the square); its return value is the list of
+    rects for pygame.display.update().
+    """
+
+    def __init__(self, surface, size=BOARD_SIZE):
+        self.surface = surface
+        self.geo = geometry(size)
+        self.size = size
+        self.cell = WIDTH // size
+        self.background = self._render_background()
+        self.sprites = {KING: self._render_piece(GOLD), DEFENDER: self._render_piece(WHITE),
+                        ATTACKER: self._render_piece(RED)}
+        self.invalidate()
+
+    def _render_background(self):
+        bg = pygame.Surface((WIDTH, HEIGHT))
+        bg.fill(BROWN)
+
+        # castle + throne, then corners (where the king escapes on the larger boards)
+        geo = self.geo
+        for sq in iter_bits(geo.throne_mask & ~geo.castle_mask):
+            pygame.draw.rect(bg, (220, 220, 220), self._square_rect(sq))
+        for sq in iter_bits(geo.castle_mask | geo.corner_mask):
+            pygame.draw.rect(bg, (200, 200, 200), self._square_rect(sq))
+
+        # grid
+        cell, edge = self.cell, self.cell * self.size
+        for row in range(self.size + 1):
+            pygame.draw.line(bg, BLACK, (0, row * cell), (edge, row * cell), 2)
+            pygame.draw.line(bg, BLACK, (row * cell, 0), (row * cell, edge), 2)
+        return bg.convert()
+
+    def _render_piece(self, color):
+        cell = self.cell
+        sprite = pygame.Surface((cell, cell), pygame.SRCALPHA)
+        center = (cell // 2, cell // 2)
+        radius = cell // 3
+        pygame.draw.circle(sprite, color, center, radius)
+        pygame.draw.circle(sprite, BLACK, center, radius, 2)
+        return sprite.convert_alpha()
+
+    def invalidate(self):
+        """Repaint everything on the next draw (e.g. after the window was exposed)."""
+        self._bitboards = None    # position as last drawn
+        self._marks = {}          # {square: (color, width)} highlight outlines
+        self._selection = None    # (selected_piece, bitboards) the marks were computed for
+        self._status = None       # (text, color) as last drawn
+        self._status_surf = None
+        self._status_rect = None
+
+    def square_at(self, pos):
+        """(row, col) under a window position, or None off the board."""
+        row, col = pos[1] // self.cell, pos[0] // self.cell
+        return (row, col) if self.geo.in_bounds(row, col) else None
+
+    def _square_rect(self, sq):
+        row, col = divmod(sq, self.size)
+        return pygame.Rect(col * self.cell, row * self.cell, self.cell, self.cell)
+
+    def _squares_under(self, rect):
+        if rect is None:
+            return set()
+        cell, last = self.cell, self.size - 1
+        rows = range(max(rect.top // cell, 0), min((rect.bottom - 1) // cell, last) + 1)
+        cols = range(max(rect.left // cell, 0), min((rect.right - 1) // cell, last) + 1)
+        return {r * self.size + c for r in rows for c in cols}
+
+    def draw(self, game, status_msg=None):
+        """Bring the surface up to date with game; returns the rects that changed."""
+        bitboards = tuple(game.bitboards)
+        full = self._bitboards is None
+        dirty = set()
+        if not full and bitboards != self._bitboards:
+            changed = 0
+            for old, new in zip(self._bitboards, bitboards):
+                changed |= old ^ new
+            dirty.update(iter_bits(changed))
+        self._bitboards = bitboards
+
+        # selected & valid moves, recomputed only when selection or position change
+        selection = (game.selected_piece, bitboards)
+        if selection != self._selection:
+            marks = {}
+            if game.selected_piece:
+                row, col = game.selected_piece
+                for mr, mc in game.get_valid_moves(row, col):
+                    marks[mr * self.size + mc] = ((0, 255, 0), 2)
+                marks[row * self.size + col] = (YELLOW, 3)
+            dirty.update(sq for sq in marks.keys() | self._marks.keys()
+                         if marks.get(sq) != self._marks.get(sq))
+            self._marks, self._selection = marks, selection
+
+        # status line, rendered again only when its text changes
+        status = status_line(game, status_msg)
+        if status != self._status:
+            dirty |= self._squares_under(self._status_rect)
+            line, color = status
+            self._status = status
+            self._status_surf = None
+            if line:
+                # step down the font size until the line fits the window
+                for size in (36, 28, 22):
+                    self._status_surf = ui_font(size).render(line, True, color)
+                    if self._status_surf.get_width() <= WIDTH - 20:
+                        break
+            self._status_rect = None
+            if self._status_surf:
+                self._status_rect = self._status_surf.get_rect(midtop=(WIDTH // 2, 20))
+                dirty |= self._squares_under(self._status_rect)
+
+        surface = self.surface
+        if full:
+            dirty = range(self.geo.num_squares)
+            # the strip past the last square when size doesn't divide WIDTH
+            surface.blit(self.background, (0, 0))
+        rects = []
+        for sq in dirty:
+            rect = self._square_rect(sq)
+            surface.blit(self.background, rect, rect)
+            piece = game.piece_at(sq)
+            if piece is not None:
+                surface.blit(self.sprites[piece], rect)
+            mark = self._marks.get(sq)
+            if mark:
+                pygame.draw.rect(surface, mark[0], rect, mark[1])
+            if self._status_rect and rect.colliderect(self._status_rect):
+                # clipped, so text over squares that didn't change isn't blended twice
+                surface.set_clip(rect)
+                surface.blit(self._status_surf, self._status_rect)
+                surface.set_clip(None)
+            rects.append(rect)
+        return [surface.get_rect()] if full else rects
 
 def text_input_screen(prompt, digits_only=False, max_len=12):
-    font = pygame.font.Font(None, 48)
+    font = ui_font(48)
     input_str = ""
+    scheduler = FrameScheduler()
     while True:
         screen.fill((45, 35, 25))
         txt = font.render(prompt, True, WHITE)
@@ -379,11 +563,11 @@ def text_input_screen(prompt, digits_only=False, max_len=12):
         pygame.draw.rect(screen, WHITE, box, 2)
         val = font.render(input_str, True, WHITE)
         screen.blit(val, (60, 190))
-        hint = pygame.font.Font(None, 28).render("Enter to confirm, Esc to quit, Backspace to edit", True, (200,200,200))
+        hint = ui_font(28).render("Enter to confirm, Esc to quit, Backspace to edit", True, (200,200,200))
         screen.blit(hint, (50, 260))
         pygame.display.flip()
 
-        for event in pygame.event.get():
+        for event in scheduler.events():
             if event.type == pygame.QUIT:
                 pygame.quit(); sys.exit()
             if event.type == pygame.KEYDOWN:
@@ -404,27 +588,28 @@ def text_input_screen(prompt, digits_only=False, max_len=12):
                                 # allow simple alnum + underscore/hyphen/space
                                 if ch.isalnum() or ch in "_- ":
                                     input_str += ch
-        clock.tick(30)
 
 # ------------------ MENU HELPERS ------------------
 def draw_button(rect, label, hovered=False):
     bg = (240, 200, 60) if hovered else (210, 180, 140)
     pygame.draw.rect(screen, bg, rect, border_radius=12)
     pygame.draw.rect(screen, BLACK, rect, 2, border_radius=12)
-    font = pygame.font.SysFont(None, 48)
-    text = font.render(label, True, BLACK)
+    text = ui_font(48).render(label, True, BLACK)
     screen.blit(text, (rect.centerx - text.get_width()//2, rect.centery - text.get_height()//2))
 
 def start_menu():
-    """Return 'ONLINE' or 'LOCAL' based on the user's choice."""
+    """Return 'ONLINE', 'QUICK', 'LOCAL' or 'AI' based on the user's choice."""
     title_font = pygame.font.Font(None, 72)
     sub_font = pygame.font.Font(None, 32)
 
     # Layout
     btn_w, btn_h = 500, 80
     online_rect = pygame.Rect(WIDTH//2 - btn_w//2, HEIGHT//2 - 60, btn_w, btn_h)
-    local_rect  = pygame.Rect(WIDTH//2 - btn_w//2, HEIGHT//2 + 40, btn_w, btn_h)
+    quick_rect  = pygame.Rect(WIDTH//2 - btn_w//2, HEIGHT//2 + 40, btn_w, btn_h)
+    local_rect  = pygame.Rect(WIDTH//2 - btn_w//2, HEIGHT//2 + 140, btn_w, btn_h)
+    ai_rect     = pygame.Rect(WIDTH//2 - btn_w//2, HEIGHT//2 + 240, btn_w, btn_h)
 
+    scheduler = FrameScheduler()
     while True:
         screen.fill((45, 35, 25))
         title = title_font.render("Hnefatafl", True, GOLD)
@@ -434,15 +619,16 @@ def start_menu():
 
         mx, my = pygame.mouse.get_pos()
         draw_button(online_rect, "Multiplayer Online", online_rect.collidepoint(mx, my))
+        draw_button(quick_rect,  "Quick Match (Online)", quick_rect.collidepoint(mx, my))
         draw_button(local_rect,  "Play With Friends (Local)", local_rect.collidepoint(mx, my))
+        draw_button(ai_rect,     "Play vs Computer", ai_rect.collidepoint(mx, my))
 
         hint = sub_font.render("Press Esc to quit", True, (220,220,220))
         screen.blit(hint, (WIDTH//2 - hint.get_width()//2, HEIGHT - 80))
 
         pygame.display.flip()
-        clock.tick(60)
 
-        for event in pygame.event.get():
+        for event in scheduler.events():
             if event.type == pygame.QUIT:
                 pygame.quit(); sys.exit()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
@@ -450,8 +636,41 @@ def start_menu():
             elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 if online_rect.collidepoint(event.pos):
                     return "ONLINE"
+                if quick_rect.collidepoint(event.pos):
+                    return "QUICK"
                 if local_rect.collidepoint(event.pos):
                     return "LOCAL"
+                if ai_rect.collidepoint(event.pos):
+                    return "AI"
+def size_menu():
+    """Return the board size the user picks (one of BOARD_SIZES)."""
+    title_font = pygame.font.Font(None, 72)
+    btn_w, btn_h = 500, 80
+    top = HEIGHT//2 - (len(BOARD_SIZES) * 100) // 2 + 40
+    buttons = [(size, pygame.Rect(WIDTH//2 - btn_w//2, top + i * 100, btn_w, btn_h))
+               for i, size in enumerate(BOARD_SIZES)]
+
+    scheduler = FrameScheduler()
+    while True:
+        screen.fill((45, 35, 25))
+        title = title_font.render("Board size", True, GOLD)
+        screen.blit(title, (WIDTH//2 - title.get_width()//2, 140))
+
+        mx, my = pygame.mouse.get_pos()
+        for size, rect in buttons:
+            draw_button(rect, SIZE_LABELS[size], rect.collidepoint(mx, my))
+        pygame.display.flip()
+
+        for event in scheduler.events():
+            if event.type == pygame.QUIT:
+                pygame.quit(); sys.exit()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                pygame.quit(); sys.exit()
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                for size, rect in buttons:
+                    if rect.collidepoint(event.pos):
+                        return size
+
 def show_message_screen(message):
     """Display a simple message while blocking operations run."""
     font = pygame.font.Font(None, 60)
@@ -465,14 +684,22 @@ def show_message_screen(message):
 #                       MAIN LOOP
 # =====================================================
 def main():
+    if AI_DEBUG_LOG:
+        logging.basicConfig(level=logging.DEBUG, format="[%(name)s] %(message)s")
+    init_display()
+
     # 0) Show start menu
     mode = start_menu()
+    size = size_menu()
 
-    game = Hnefatafl()
+    game = Hnefatafl(size=size)
+    ai = None
 
-    if mode == "ONLINE":
-        # 1) Ask for room code and nickname
-        room_code = text_input_screen("Enter room code (numbers only):", digits_only=True, max_len=4)
+    if mode in ("ONLINE", "QUICK"):
+        # 1) Ask for room code (quickmatch: the relay pairs us) and nickname
+        room_code = None
+        if mode == "ONLINE":
+            room_code = text_input_screen("Enter room code (numbers only):", digits_only=True, max_len=4)
         nickname = text_input_screen("Enter your nickname:", digits_only=False, max_len=16)
         game.my_name = nickname
 
@@ -483,7 +710,8 @@ def main():
 
         def connect_to_server():
             try:
-                n = NetClient(SERVER_HOST, SERVER_PORT, room_code, nickname)
+                n = NetClient(SERVER_HOST, SERVER_PORT, room_code, nickname, on_message=post_wake,
+                              size=size)
                 net_ref[0] = n
                 connected[0] = True
             except ConnectionError as e:
@@ -523,6 +751,17 @@ def main():
 
 
 
+    elif mode == "AI":
+        # Human plays the defenders, the computer the attackers
+        game.my_side = "DEFENDER"
+        game.turn_side = "DEFENDER"
+        game.current_player = DEFENDER
+        game.my_name = "You"
+        game.opponent_name = "Computer"
+        game.waiting = False
+        ai = AIPlayer(ATTACKER, time_budget=AI_TIME_BUDGET, on_done=post_wake)
+        status_msg = "Vs computer: you are DEFENDER"
+
     else:
         # Local pass-and-play setup
         game.my_side = "LOCAL"
@@ -534,53 +773,108 @@ def main():
         status_msg = "Local match: Defenders start"
 
     # 3) Main loop
+    renderer = BoardRenderer(screen, game.size)
+    scheduler = FrameScheduler()
+    events = []
     while True:
         # Handle inbound network messages (ONLINE only)
         if game.net:
             try:
                 while True:
-                    msg = game.net.inbox.get_nowait()
-                    mtype = msg.get("type")
-                    if mtype == "waiting":
-                        players = msg.get("players", [])
-                        status_msg = "Waiting for opponent... (" + ", ".join(players) + ")"
-                        game.waiting = True
-                    elif mtype == "joined":
-                        jn = msg.get("name","Someone")
-                        status_msg = f"{jn} joined. Waiting for opponent..."
-                        game.waiting = True
-                    elif mtype == "start":
-                        game.my_side = msg.get("your_side")
-                        game.turn_side = msg.get("current_player")
-                        game.current_player = ATTACKER if game.turn_side == "ATTACKER" else DEFENDER
-                        game.opponent_name = msg.get("opponent_name","Opponent")
-                        status_msg = f"You are {game.my_side}. Opponent: {game.opponent_name}"
-                        game.waiting = False
-                    elif mtype == "move":
-                        fr = msg.get("from", [0,0]); to = msg.get("to", [0,0])
-                        game.move_piece(fr[0], fr[1], to[0], to[1], send=False)
-                    elif mtype == "opponent_left":
-                        left_name = msg.get("name","Opponent")
-                        status_msg = f"{left_name} left. Waiting for opponent..."
-                        game.waiting = True
-                        game.opponent_name = None
-                    elif mtype == "error":
-                        status_msg = f"Error: {msg.get('msg','')}"
-                    elif mtype == "full":
-                        status_msg = "Room is full"
+                    for msg in game.net.inbox.get_nowait():
+                        mtype = msg.get("type")
+                        if mtype == "waiting":
+                            players = msg.get("players", [])
+                            status_msg = "Waiting for opponent... (" + ", ".join(players) + ")"
+                            game.waiting = True
+                        elif mtype == "joined":
+                            jn = msg.get("name","Someone")
+                            status_msg = f"{jn} joined. Waiting for opponent..."
+                            game.waiting = True
+                        elif mtype == "start":
+                            game.my_side = msg.get("your_side")
+                            game.turn_side = msg.get("current_player")
+                            game.current_player = ATTACKER if game.turn_side == "ATTACKER" else DEFENDER
+                            game.opponent_name = msg.get("opponent_name","Opponent")
+                            status_msg = f"You are {game.my_side}. Opponent: {game.opponent_name}"
+                            game.waiting = False
+                        elif mtype == "move":
+                            fr = msg.get("from", [0,0]); to = msg.get("to", [0,0])
+                            game.move_piece(fr[0], fr[1], to[0], to[1], send=False)
+                        elif mtype == "reconnecting":
+                            status_msg = "Connection lost. Reconnecting..."
+                            game.waiting = True
+                        elif mtype == "resume":
+                            # back in our seat: replay only the moves we missed
+                            for fr, fc, tr, tc in msg.get("moves", []):
+                                game.move_piece(fr, fc, tr, tc, send=False)
+                            game.my_side = msg.get("your_side", game.my_side)
+                            game.turn_side = msg.get("current_player", game.turn_side)
+                            game.current_player = ATTACKER if game.turn_side == "ATTACKER" else DEFENDER
+                            status_msg = f"Reconnected. You are {game.my_side}"
+                            game.waiting = False
+                        elif mtype == "resume_failed":
+                            status_msg = "Could not resume the game. Waiting for opponent..."
+                            game.waiting = True
+                        elif mtype == "opponent_disconnected":
+                            status_msg = f"{msg.get('name','Opponent')} lost connection. Waiting for them..."
+                            game.waiting = True
+                        elif mtype == "opponent_resumed":
+                            status_msg = f"{msg.get('name','Opponent')} is back"
+                            game.waiting = False
+                        elif mtype == "opponent_left":
+                            left_name = msg.get("name","Opponent")
+                            status_msg = f"{left_name} left. Waiting for opponent..."
+                            game.waiting = True
+                            game.opponent_name = None
+                        elif mtype == "state":
+                            # relay's authoritative board (game start, captures, rejected moves)
+                            apply_server_state(game, msg)
+                        elif mtype == "error":
+                            status_msg = f"Error: {msg.get('msg','')}"
+                        elif mtype == "full":
+                            status_msg = "Room is full"
+                        elif mtype == "room":
+                            status_msg = "Looking for an opponent..."
+                            game.waiting = True
+                        elif mtype == "evicted":
+                            status_msg = "Room closed after being idle too long"
+                            game.waiting = True
             except queue.Empty:
                 pass
 
-        # Handle local events
-        for event in pygame.event.get():
+        # Computer opponent: searches on its own thread, we just poll
+        if ai and not game.game_over:
+            result = ai.poll()
+            if result is not None and result.move:
+                (fr, fc), (tr, tc) = (divmod(sq, game.size) for sq in result.move)
+                game.move_piece(fr, fc, tr, tc, send=False)
+                status_msg = f"Computer: depth {result.depth}, {result.nps} nodes/s"
+                log.debug("ai move=%s score=%s depth=%s nodes=%s nps=%s time=%.2fs", result.move,
+                          result.score, result.depth, result.nodes, result.nps, result.elapsed)
+            elif result is not None:
+                # no legal move: a side that cannot move loses (as in search.py),
+                # and searching again would only return at once, forever
+                game.game_over = True
+                game.winner = ATTACKER if ai.side == DEFENDER else DEFENDER
+                status_msg = "Computer has no legal move"
+            elif game.current_player == ai.side:
+                ai.start(game)
+
+        # Handle local events (collected by the scheduler at the end of the last frame)
+        for event in events:
             if event.type == pygame.QUIT:
                 if game.net: game.net.close()
+                if ai: ai.stop()
                 pygame.quit(); sys.exit()
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                # the window contents were lost, next draw repaints it all
+                renderer.invalidate()
 
             if not game.game_over and not game.waiting and event.type == pygame.MOUSEBUTTONDOWN:
                 # Determine if input is allowed this click
                 local_mode = (game.my_side == "LOCAL")
-                if game.net:
+                if game.net or ai:
                     my_turn = (
                         (game.my_side == "DEFENDER" and game.turn_side == "DEFENDER") or
                         (game.my_side == "ATTACKER" and game.turn_side == "ATTACKER")
@@ -592,9 +886,9 @@ def main():
                 if not my_turn:
                     continue
 
-                col = event.pos[0] // CELL_SIZE
-                row = event.pos[1] // CELL_SIZE
-                if 0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE:
+                square = renderer.square_at(event.pos)
+                if square is not None:
+                    row, col = square
                     def belongs_to_turn(piece):
                         if piece is None:
                             return False
@@ -636,9 +930,8 @@ def main():
                         else:
                             game.selected_piece = (row, col) if piece is not None and belongs_to_me(piece) else None
 
-        draw_board(game, status_msg)
-        pygame.display.flip()
-        clock.tick(60)
+        pygame.display.update(renderer.draw(game, status_msg))
+        events = scheduler.events()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,134 @@
+# metrics.py
+# Relay instrumentation, served as Prometheus text on a local HTTP port.
+#
+#   curl -s http://127.0.0.1:9100/metrics
+#
+# Recording is a plain int/list increment so the forward loop pays next to
+# nothing for it; all formatting happens when somebody scrapes.
+import asyncio
+import bisect
+import time
+
+# seconds; tuned for localhost-to-WAN drain times
+DRAIN_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# how often the per-second rates are recomputed
+RATE_INTERVAL = 5.0
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts[i] holds observations <= bounds[i]."""
+
+    def __init__(self, name, help_text, bounds):
+        self.name = name
+        self.help = help_text
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)   # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum:.6f}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class RelayMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.connections = 0          # currently open
+        self.connections_total = 0
+        self.messages = 0             # forwarded to a peer
+        self.bytes = 0
+        self.resumes = 0              # players back in their game after a drop
+        self.evictions = 0            # idle rooms closed by the sweeper
+        self.errors = {}              # category -> count
+        self.drain = Histogram("relay_send_drain_seconds",
+                               "Time spent waiting in writer.drain() per send", DRAIN_BUCKETS)
+        self.message_rate = 0.0
+        self.byte_rate = 0.0
+        self._last_sample = (time.monotonic(), 0, 0)
+
+    def error(self, category):
+        self.errors[category] = self.errors.get(category, 0) + 1
+
+    def sample_rates(self):
+        now = time.monotonic()
+        then, messages, nbytes = self._last_sample
+        elapsed = now - then
+        if elapsed > 0:
+            self.message_rate = (self.messages - messages) / elapsed
+            self.byte_rate = (self.bytes - nbytes) / elapsed
+        self._last_sample = (now, self.messages, self.bytes)
+
+    def render(self, gauges=()):
+        """Prometheus text exposition; gauges is extra (name, help, value) tuples."""
+        lines = []
+
+        def metric(name, kind, help_text, value):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+
+        metric("relay_start_time_seconds", "gauge", "Unix time the relay started", f"{self.started:.0f}")
+        metric("relay_connections", "gauge", "Open client connections", self.connections)
+        metric("relay_connections_total", "counter", "Client connections accepted", self.connections_total)
+        for name, help_text, value in gauges:
+            metric(name, "gauge", help_text, value)
+        metric("relay_messages_forwarded_total", "counter", "Messages forwarded to a peer", self.messages)
+        metric("relay_bytes_forwarded_total", "counter", "Bytes forwarded to a peer", self.bytes)
+        metric("relay_resumes_total", "counter", "Players that resumed a game after a drop", self.resumes)
+        metric("relay_rooms_evicted_total", "counter", "Idle rooms closed by the sweeper", self.evictions)
+        metric("relay_messages_forwarded_per_second", "gauge",
+               f"Forwarded messages per second over the last {RATE_INTERVAL:g}s", f"{self.message_rate:.2f}")
+        metric("relay_bytes_forwarded_per_second", "gauge",
+               f"Forwarded bytes per second over the last {RATE_INTERVAL:g}s", f"{self.byte_rate:.2f}")
+        lines.append("# HELP relay_errors_total Errors by category")
+        lines.append("# TYPE relay_errors_total counter")
+        for category in sorted(self.errors):
+            lines.append(f'relay_errors_total{{category="{category}"}} {self.errors[category]}')
+        lines.extend(self.drain.render())
+        return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(metrics, host, port, gauges=lambda: ()):
+    """Serve GET /metrics on host:port; gauges() is called on every scrape."""
+
+    async def sample():
+        while True:
+            await asyncio.sleep(RATE_INTERVAL)
+            metrics.sample_rates()
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass   # skip headers
+            parts = request.split()
+            if len(parts) >= 2 and parts[1] in (b"/", b"/metrics"):
+                status, body = "200 OK", metrics.render(gauges()).encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.0 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host=host, port=port)
+    sampler = asyncio.create_task(sample())
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server, sampler
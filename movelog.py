@@ -0,0 +1,112 @@
+# movelog.py
+# Append-only move logs for games played through the relay.
+#
+# One file per game, <directory>/<game_id>.hml:
+#   b"HML1"
+#   u16 length + UTF-8 JSON header (room, board size, players, sides, first player, start time)
+#   one 8-byte record per move: u32 seq, u8 from_row, from_col, to_row, to_col
+#
+# Records are only ever appended. append() writes into the file's buffer and
+# keeps the move in memory for resuming clients; LogWriter.run() flushes and
+# fsyncs every log that changed at most FSYNC_INTERVAL apart, so a burst of
+# moves across many rooms costs one round of fsyncs rather than one per move.
+import os
+import json
+import time
+import struct
+import asyncio
+
+MAGIC = b"HML1"
+HEADER_LEN = struct.Struct("!H")
+RECORD = struct.Struct("!I4B")
+FSYNC_INTERVAL = 0.25
+
+
+class MoveLog:
+    def __init__(self, path, header):
+        self.path = path
+        self.seq = 0
+        self.moves = bytearray()    # 4 bytes per move, seq 1 first
+        self.dirty = True
+        self.closed = False
+        # path None keeps the log in memory only
+        self.file = None
+        if path is not None:
+            meta = json.dumps(header, separators=(",", ":")).encode("utf-8")
+            self.file = open(path, "ab")
+            self.file.write(MAGIC + HEADER_LEN.pack(len(meta)) + meta)
+
+    def append(self, fr, fc, tr, tc):
+        """Record one move; returns its sequence number."""
+        self.seq += 1
+        self.moves += bytes((fr, fc, tr, tc))
+        if self.file is not None:
+            self.file.write(RECORD.pack(self.seq, fr, fc, tr, tc))
+        self.dirty = True
+        return self.seq
+
+    def since(self, seq):
+        """Moves after seq as [[from_row, from_col, to_row, to_col], ...]."""
+        data = self.moves[4 * seq:]
+        return [list(data[i:i + 4]) for i in range(0, len(data), 4)]
+
+
+def read_log(path):
+    """(header, moves) from a log file; a torn last record is ignored."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path}: not a move log")
+    pos = len(MAGIC)
+    (length,) = HEADER_LEN.unpack_from(data, pos)
+    pos += HEADER_LEN.size
+    header = json.loads(data[pos:pos + length].decode("utf-8"))
+    pos += length
+    moves = []
+    while pos + RECORD.size <= len(data):
+        seq, fr, fc, tr, tc = RECORD.unpack_from(data, pos)
+        moves.append((seq, fr, fc, tr, tc))
+        pos += RECORD.size
+    return header, moves
+
+
+class LogWriter:
+    """Opens game logs in one directory and fsyncs them in batches."""
+
+    def __init__(self, directory, interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.logs = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, game_id, header):
+        header = dict(header, game=game_id, started=time.time())
+        log = MoveLog(os.path.join(self.directory, game_id + ".hml"), header)
+        self.logs.add(log)
+        return log
+
+    def close(self, log):
+        # the file is closed by run() after its last fsync
+        log.closed = True
+        log.dirty = True
+
+    def _sync(self, files):
+        for f in files:
+            os.fsync(f.fileno())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            batch = [log for log in self.logs if log.dirty]
+            if not batch:
+                continue
+            for log in batch:
+                log.file.flush()
+                log.dirty = False
+            # fsync blocks, keep it off the event loop
+            await loop.run_in_executor(None, self._sync, [log.file for log in batch])
+            for log in batch:
+                if log.closed and not log.dirty:
+                    log.file.close()
+                    self.logs.discard(log)
@@ -0,0 +1,196 @@
+# protocol.py
+# Wire formats shared by NetClient (main.py) and relay_server.py.
+#
+# Every connection starts in JSON mode: one JSON object per line. A client
+# that understands binary framing adds "protocols": ["bin1"] to its join
+# message; a relay that understands it answers with the JSON line
+# {"type": "proto", "mode": "bin1"} and both sides switch to binary frames
+# for everything after that line. Old clients and old relays never send or
+# answer the field, so they keep talking JSON.
+#
+# Binary frame: u16 length (big endian, counts the type byte and payload),
+# u8 type code, payload.
+#   FRAME_MOVE  payload = from_row, from_col, to_row, to_col as four u8
+#   FRAME_JSON  payload = UTF-8 JSON object (control messages, anything else)
+import asyncio
+import json
+import re
+import struct
+
+PROTO_JSON = "json"
+PROTO_BIN = "bin1"
+
+FRAME_JSON = 0x01
+FRAME_MOVE = 0x02
+
+HEADER = struct.Struct("!HB")
+MOVE = struct.Struct("!4B")
+MAX_FRAME = 0xFFFF
+# StreamDecoder.recv_from() reads up to this much per call
+RECV_SIZE = 64 * 1024
+
+# the message type of a JSON line whose first key is "type", without parsing the whole object
+_TYPE_RE = re.compile(rb'\s*\{\s*"type"\s*:\s*"([A-Za-z_]+)"\s*[,}]')
+
+
+def encode_json_line(obj):
+    return (json.dumps(obj, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def decode_json_line(line):
+    return json.loads(line.decode("utf-8").strip())
+
+
+def encode_frame(obj):
+    """Binary frame for obj; moves get the packed form, the rest travel as JSON."""
+    if obj.get("type") == "move" and len(obj) == 3:
+        try:
+            payload = MOVE.pack(*obj["from"], *obj["to"])
+            return HEADER.pack(1 + MOVE.size, FRAME_MOVE) + payload
+        except (KeyError, TypeError, struct.error):
+            pass
+    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    if len(payload) + 1 > MAX_FRAME:
+        raise ValueError("message too large for one frame")
+    return HEADER.pack(1 + len(payload), FRAME_JSON) + payload
+
+
+def decode_frame(ftype, payload):
+    if ftype == FRAME_MOVE:
+        if len(payload) != MOVE.size:
+            raise ValueError(f"move frame with a {len(payload)}-byte payload")
+        fr, fc, tr, tc = MOVE.unpack(payload)
+        return {"type": "move", "from": [fr, fc], "to": [tr, tc]}
+    if ftype == FRAME_JSON:
+        return json.loads(payload.decode("utf-8"))
+    raise ValueError(f"unknown frame type {ftype}")
+
+
+def encode(obj, proto):
+    """Bytes for obj in the given connection mode (PROTO_JSON or PROTO_BIN)."""
+    return encode_frame(obj) if proto == PROTO_BIN else encode_json_line(obj)
+
+
+async def read_message(reader, proto):
+    """Next message from an asyncio StreamReader, or None at EOF."""
+    if proto == PROTO_BIN:
+        try:
+            header = await reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError:
+            return None
+        length, ftype = HEADER.unpack(header)
+        if length < 1:
+            raise ValueError("empty frame")
+        payload = await reader.readexactly(length - 1)
+        return decode_frame(ftype, payload)
+    line = await reader.readline()
+    if not line:
+        return None
+    return decode_json_line(line)
+
+
+async def read_raw(reader, proto):
+    """Next complete line or frame as raw bytes (b"" at EOF), without decoding it."""
+    if proto == PROTO_BIN:
+        try:
+            header = await reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError:
+            return b""
+        length = HEADER.unpack(header)[0]
+        if length < 1:
+            raise ValueError("empty frame")
+        return header + await reader.readexactly(length - 1)
+    return await reader.readline()
+
+
+def peek_type(raw, proto):
+    """Message type of a raw line/frame, found without a JSON parse.
+
+    Only answers when the bytes leave no doubt about what json.loads would
+    see: "type" is the first key, it occurs exactly once and the line has
+    no escapes (so no duplicate or escaped "type" key can override it).
+    Anything else gives None and has to be decoded to be classified.
+    """
+    if proto == PROTO_BIN:
+        if raw[2] == FRAME_MOVE:
+            return "move" if len(raw) == HEADER.size + MOVE.size else None
+        raw = raw[HEADER.size:]
+    if b"\\" in raw or raw.count(b'"type"') != 1:
+        return None
+    m = _TYPE_RE.match(raw)
+    return m.group(1).decode("ascii") if m else None
+
+
+def decode_raw(raw, proto):
+    """Decode bytes returned by read_raw."""
+    if proto == PROTO_BIN:
+        return decode_frame(raw[2], raw[HEADER.size:])
+    return decode_json_line(raw)
+
+
+class StreamDecoder:
+    """Incremental decoder for a blocking socket (the client side).
+
+    feed() takes raw bytes and returns every complete message. A
+    {"type": "proto"} line switches the decoder to the announced mode for
+    the bytes that follow it in the same chunk; it is only honoured as the
+    very first message, which is where the relay sends its ack.
+
+    Bytes are buffered in a bytearray and consumed through a read cursor;
+    the consumed prefix is dropped once per feed(), so a burst of N small
+    messages costs O(N) copying rather than re-slicing the rest of the
+    buffer after every message.
+    """
+
+    def __init__(self, proto=PROTO_JSON, recv_size=RECV_SIZE):
+        self.proto = proto
+        self.buff = bytearray()
+        self.seen = 0
+        self._chunk = bytearray(recv_size)
+
+    def recv_from(self, sock):
+        """Read one chunk from sock with recv_into() and return the messages it completed."""
+        n = sock.recv_into(self._chunk)
+        if not n:
+            raise ConnectionError("connection closed")
+        return self.feed(memoryview(self._chunk)[:n])
+
+    def feed(self, data):
+        buff = self.buff
+        buff += data
+        pos = 0
+        out = []
+        while True:
+            if self.proto == PROTO_BIN:
+                if len(buff) - pos < HEADER.size:
+                    break
+                length, ftype = HEADER.unpack_from(buff, pos)
+                if length < 1:
+                    # no type byte, so no telling where the next frame starts
+                    raise ValueError("empty frame")
+                end = pos + 2 + length
+                if len(buff) < end:
+                    break
+                payload = buff[pos + HEADER.size:end]
+                pos = end
+                try:
+                    out.append(decode_frame(ftype, payload))
+                except ValueError:
+                    pass
+                self.seen += 1
+            else:
+                nl = buff.find(b"\n", pos)
+                if nl < 0:
+                    break
+                line = buff[pos:nl]
+                pos = nl + 1
+                try:
+                    obj = decode_json_line(line)
+                except ValueError:
+                    continue
+                out.append(obj)
+                if obj.get("type") == "proto" and not self.seen:
+                    self.proto = obj.get("mode", PROTO_JSON)
+                self.seen += 1
+        del buff[:pos]
+        return out
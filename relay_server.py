@@ -1,14 +1,177 @@
 # relay_server.py
-import asyncio, json, random
+import asyncio, json, random, secrets, collections, socket, argparse, multiprocessing, zlib, time, traceback
 
-# room_code -> {"a": {"r": reader, "w": writer, "name": str},
-#               "b": {"r": reader, "w": writer, "name": str}}
+from protocol import PROTO_JSON, PROTO_BIN, encode, read_raw, peek_type, decode_raw
+from engine import Hnefatafl, BOARD_SIZE, BOARD_SIZES, DEFENDER, ATTACKER
+from bitboard import SIDE_OF, iter_bits
+from metrics import RelayMetrics, serve_metrics
+from movelog import MoveLog, LogWriter
+
+# Player messages are forwarded as the raw bytes received. These types are
+# meant for the relay itself and are never passed on (a forwarded "proto"
+# would flip the opponent's decoder). "leave" ends the session for good,
+# skipping the resume grace period; "ping"/"pong" are heartbeats.
+CONTROL_TYPES = {"join", "proto", "leave", "ping", "pong"}
+# The only types a player may send to its opponent. Everything else the
+# relay sends itself (state, start, resume, error, evicted, ...) and a player
+# sending one is dropped, or a modified client could rewrite its opponent's
+# board.
+PEER_TYPES = {"move"}
+# Keep an engine per room and only relay legal moves from the side to move
+VALIDATE_MOVES = True
+
+HOST = "0.0.0.0"
+PORT = 8765
+# sharded mode: the acceptor reads at most this much before routing a socket
+MAX_HELLO = 4096
+HELLO_TIMEOUT = 10.0
+# Prometheus text endpoint, local only; with --shards shard i uses METRICS_PORT + i
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+# Outbound queues: bytes a connection may have waiting in its Outbox before
+# it counts as a slow consumer, and the transport's own buffer limit on top
+OUTBOX_HIGH_WATER = 256 * 1024
+TRANSPORT_HIGH_WATER = 64 * 1024
+# "disconnect" drops a slow consumer, "drop" discards what doesn't fit.
+# Players need every move, so dropping is only safe for passive viewers.
+SLOW_CONSUMER_POLICY = "disconnect"
+# how long a closing connection may take to flush its queue
+CLOSE_FLUSH_TIMEOUT = 2.0
+# Spectators: join with "spectate": true. They get a smaller outbox and the
+# "drop" policy; one that fell behind is resynced with a state snapshot.
+MAX_SPECTATORS = 1000
+SPECTATOR_HIGH_WATER = 64 * 1024
+# Every game is logged move by move to MOVE_LOG_DIR (None keeps logs in
+# memory only). A player whose socket drops mid-game keeps the slot for
+# RESUME_GRACE seconds and can reconnect with its token (0 disables).
+MOVE_LOG_DIR = "movelogs"
+RESUME_GRACE = 60.0
+# Heartbeats: the sweeper pings a connection that has been silent for
+# HEARTBEAT_INTERVAL. Once a client has answered a ping it is dropped after
+# HEARTBEAT_TIMEOUT without hearing from it (clients that never pong are
+# only pinged, a dead one then shows up as a failed write).
+HEARTBEAT_INTERVAL = 15.0
+HEARTBEAT_TIMEOUT = 45.0
+# The sweeper also evicts rooms nobody has sent a message in for
+# ROOM_IDLE_TIMEOUT (still waiting for a second player) or GAME_IDLE_TIMEOUT.
+SWEEP_INTERVAL = 5.0
+ROOM_IDLE_TIMEOUT = 600.0
+GAME_IDLE_TIMEOUT = 1800.0
+# Quickmatch players get a generated room code with this prefix. With
+# --shards every quickmatch room lives on shard 0, next to the queue.
+QUICKMATCH_PREFIX = "qm-"
+
+SIDE_NAMES = {DEFENDER: "DEFENDER", ATTACKER: "ATTACKER"}
+SIDE_CODES = {"DEFENDER": DEFENDER, "ATTACKER": ATTACKER}
+
+# room_code -> {"a": {"r": reader, "w": writer, "out": Outbox, "name": str, "proto": str,
+#                     "size": board size}, "b": {...same...}}
+# r/w/out are None while a dropped player's slot is held for resuming
+# (then "expire" is the timer that frees it)
 rooms = {}
+# room_code -> {"game": Hnefatafl, "id": str, "log": MoveLog,
+#               "sides": {"a": DEFENDER/ATTACKER, "b": ...}, "tokens": {"a": str, "b": str}}
+# created when a game starts, dropped when a player leaves for good
+games = {}
+# room_code -> {writer: {"w": writer, "out": Outbox, "proto": str}}
+# spectators are independent of the two player slots and outlive games
+spectators = {}
+# board size -> quickmatch rooms with one player waiting, oldest first; rooms
+# that filled up or emptied in the meantime are skipped when popped
+quickmatch_queues = collections.defaultdict(collections.deque)
+# writer -> {"r": reader, "out": Outbox, "proto": str, "seen": t, "active": t,
+#            "pinged": t, "pongs": bool}, for every open connection (monotonic times:
+# seen = anything received, active = last message that wasn't a heartbeat)
+conns = {}
+metrics = RelayMetrics()
+# set by start_move_logs() once the event loop runs
+log_writer = None
+
+# ------------------ OUTBOUND QUEUES ------------------
+class Outbox:
+    """Bounded send queue of one connection, written out by its own task.
+
+    push() never waits, so a client that reads slowly only ever delays
+    itself: its opponent's reader task and broadcasts to other peers carry
+    on. The writer task batches whatever queued up while it was draining
+    into a single write.
+    """
 
-async def send(writer, obj):
-    data = (json.dumps(obj) + "\n").encode("utf-8")
-    writer.write(data)
-    await writer.drain()
+    def __init__(self, writer, high_water=OUTBOX_HIGH_WATER, policy=SLOW_CONSUMER_POLICY):
+        self.writer = writer
+        self.high_water = high_water
+        self.policy = policy
+        self.chunks = collections.deque()
+        self.queued = 0
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        writer.transport.set_write_buffer_limits(high=TRANSPORT_HIGH_WATER)
+        self.task = asyncio.create_task(self._run())
+
+    def push(self, data):
+        """Queue bytes for sending; False if they were refused."""
+        if self.closed:
+            return False
+        if self.queued + len(data) > self.high_water:
+            metrics.error("slow_consumer")
+            if self.policy == "drop":
+                self.dropped += 1
+            else:
+                self.abort()
+            return False
+        self.chunks.append(data)
+        self.queued += len(data)
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                if not self.chunks:
+                    if self.closed:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                data = self.chunks[0] if len(self.chunks) == 1 else b"".join(self.chunks)
+                self.chunks.clear()
+                self.queued = 0
+                self.writer.write(data)
+                t0 = time.perf_counter()
+                await self.writer.drain()
+                metrics.drain.observe(time.perf_counter() - t0)
+        except (ConnectionError, OSError):
+            metrics.error("send")
+            self.closed = True
+            self.chunks.clear()
+
+    def abort(self):
+        """Drop the connection now, discarding anything queued."""
+        self.closed = True
+        self.chunks.clear()
+        self.queued = 0
+        self.writer.transport.abort()
+        self._wakeup.set()
+
+    async def aclose(self):
+        """Flush the queue (within CLOSE_FLUSH_TIMEOUT) and close the socket."""
+        self.closed = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self.task, CLOSE_FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.error("close")
+        try:
+            self.writer.close(); await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            metrics.error("close")
+
+def send(out, obj, proto=PROTO_JSON):
+    return out.push(encode(obj, proto))
+
+def send_raw(out, data):
+    return out.push(data)
 
 def players_list(roommap):
     out = []
@@ -17,103 +180,677 @@ def players_list(roommap):
             out.append(roommap[k]["name"])
     return out
 
-async def notify_room(room, obj, exclude=None):
+def notify_room(room, obj, exclude=None):
+    # encoded once per framing; every peer's writer task sends it in parallel
+    encoded = {}
     for k in ("a","b"):
-        if k in room and room[k]["w"] is not exclude:
-            try:
-                await send(room[k]["w"], obj)
-            except Exception:
-                pass
+        if k in room and room[k]["out"] is not None and room[k]["w"] is not exclude:
+            proto = room[k]["proto"]
+            if proto not in encoded:
+                encoded[proto] = encode(obj, proto)
+            room[k]["out"].push(encoded[proto])
+
+def room_gauges():
+    waiting = sum(1 for rm in rooms.values() if len(rm) == 1)
+    return [("relay_rooms", "Rooms with at least one player", len(rooms)),
+            ("relay_waiting_rooms", "Rooms waiting for a second player", waiting),
+            ("relay_games", "Games in progress", len(games)),
+            ("relay_spectators", "Connected spectators",
+             sum(len(group) for group in spectators.values()))]
+
+# ------------------ SPECTATORS ------------------
+def watching_message(room_code):
+    """Roster for spectators: who is in the room and, once started, who plays what."""
+    rm = rooms.get(room_code, {})
+    msg = {"type":"watching", "room": room_code, "players": players_list(rm)}
+    if rm:
+        msg["size"] = room_size(rm)
+    state = games.get(room_code)
+    if state:
+        msg["sides"] = {SIDE_NAMES[state["sides"][k]]: rm[k]["name"] for k in ("a","b") if k in rm}
+    return msg
+
+def fan_out(room_code, obj=None, raw=None, proto=PROTO_JSON):
+    """Send one message to every spectator of room_code.
+
+    raw (bytes in proto framing) is passed through as is; each other framing
+    is encoded at most once and the same buffer is pushed to every spectator.
+    """
+    group = spectators.get(room_code)
+    if not group:
+        return
+    encoded = {proto: raw} if raw is not None else {}
+    for w in group.values():
+        out = w["out"]
+        if out.dropped:
+            # it lost messages while lagging: once it has room again, one
+            # snapshot (which already includes this message's move) catches it up
+            state = games.get(room_code)
+            if state is None or out.queued > out.high_water // 2:
+                continue
+            out.dropped = 0
+            send(out, state_message(state["game"]), w["proto"])
+            continue
+        p = w["proto"]
+        if p not in encoded:
+            if obj is None:
+                obj = decode_raw(raw, proto)
+            encoded[p] = encode(obj, p)
+        out.push(encoded[p])
+
+async def spectate(reader, writer, out, room_code, proto):
+    group = spectators.setdefault(room_code, {})
+    if len(group) >= MAX_SPECTATORS:
+        metrics.error("room_full")
+        send(out, {"type":"full"}, proto)
+        return
+    out.high_water = SPECTATOR_HIGH_WATER
+    out.policy = "drop"
+    group[writer] = {"w": writer, "out": out, "proto": proto}
+    try:
+        send(out, watching_message(room_code), proto)
+        state = games.get(room_code)
+        if state:
+            send(out, state_message(state["game"]), proto)
+        # spectators only listen; anything but heartbeats is ignored
+        conn = conns[writer]
+        while True:
+            raw = await read_raw(reader, proto)
+            if not raw:
+                break
+            conn["seen"] = time.monotonic()
+            heartbeat(conn, peek_type(raw, proto), raw)
+    finally:
+        group.pop(writer, None)
+        if not group and spectators.get(room_code) is group:
+            del spectators[room_code]
+
+# ------------------ AUTHORITATIVE STATE ------------------
+def state_message(game, captured=()):
+    """Authoritative position snapshot; clients replace their board with it."""
+    bb = game.bitboards
+    return {"type":"state", "pos":[bb[0], bb[1], bb[2]], "size": game.size,
+            "turn": SIDE_NAMES[game.current_player],
+            "game_over": game.game_over,
+            "winner": SIDE_NAMES.get(game.winner),
+            "captured": [list(divmod(sq, game.size)) for sq in captured],
+            # moves played so far; the relay's game only ever moves forward
+            "seq": len(game.undo_stack)}
+
+def apply_move(state, slot, obj):
+    """Validate obj for slot and play it on the room's engine.
+
+    Returns an error string, or None when the move was legal and applied.
+    """
+    game = state["game"]
+    if game.game_over:
+        return "game over"
+    if state["sides"][slot] != game.current_player:
+        return "not your turn"
+    try:
+        (fr, fc), (tr, tc) = obj["from"], obj["to"]
+    except (KeyError, TypeError, ValueError):
+        return "bad move"
+    coords = (fr, fc, tr, tc)
+    # no coercion: the peer gets these exact values, so "3" or 3.9 is refused
+    if not all(type(v) is int for v in coords):
+        return "bad move"
+    geo = game.geo
+    if not (geo.in_bounds(coords[0], coords[1]) and geo.in_bounds(coords[2], coords[3])):
+        return "illegal move"
+    from_sq, to_sq = geo.square(coords[0], coords[1]), geo.square(coords[2], coords[3])
+    piece = game.piece_at(from_sq)
+    if piece is None or SIDE_OF[piece] != game.current_player:
+        return "not your piece"
+    if not game.legal_targets(from_sq) & 1 << to_sq:
+        return "illegal move"
+    game.make_move(from_sq, to_sq)
+    state["log"].append(*coords)
+    return None
+
+def classify(raw, proto):
+    """(type, obj) of a player's raw message.
+
+    The bytes are trusted without decoding (obj None) only when peek_type
+    is certain and the type needs no parse: control messages, and moves
+    when VALIDATE_MOVES is off. Everything else is decoded and classified
+    by its decoded "type"; ValueError if it doesn't decode.
+    """
+    mtype = peek_type(raw, proto)
+    if mtype in CONTROL_TYPES or (mtype == "move" and not VALIDATE_MOVES):
+        return mtype, None
+    obj = decode_raw(raw, proto)
+    if not isinstance(obj, dict):
+        raise ValueError("message is not an object")
+    return obj.get("type"), obj
+
+def last_move_captures(game):
+    """Squares emptied by captures in the last make_move."""
+    _, _, _, captured, king_taken = game.undo_stack[-1][:5]
+    out = list(iter_bits(captured))
+    if king_taken is not None:
+        out.append(king_taken)
+    return out
+
+# ------------------ QUICKMATCH ------------------
+def quickmatch_room(size):
+    """Room code for a quickmatch player: the oldest open room of that board size or a new one."""
+    queue = quickmatch_queues[size]
+    while queue:
+        room_code = queue.popleft()
+        rm = rooms.get(room_code)
+        if rm is not None and len(rm) == 1 and room_code not in games:
+            return room_code
+    room_code = QUICKMATCH_PREFIX + secrets.token_hex(4)
+    queue.append(room_code)
+    return room_code
+
+def room_size(rm):
+    """Board size of a room: the size its first player asked for."""
+    return next(iter(rm.values()))["size"]
+
+# ------------------ GAMES / RESUME ------------------
+def start_game(room_code, rm):
+    """Pick sides, create the authoritative game and its move log, send "start"."""
+    sides = ["DEFENDER","ATTACKER"]
+    random.shuffle(sides)
+    current = "ATTACKER"   # or "DEFENDER" if you prefer
+
+    size = room_size(rm)
+    game = Hnefatafl(size=size)
+    game.current_player = SIDE_CODES[current]
+    game_id = secrets.token_hex(8)
+    header = {"room": room_code, "first": current, "size": size,
+              "players": {sides[0]: rm["a"]["name"], sides[1]: rm["b"]["name"]}}
+    log = log_writer.open(game_id, header) if log_writer else MoveLog(None, header)
+    state = {"game": game, "id": game_id, "log": log,
+             "sides": {"a": SIDE_CODES[sides[0]], "b": SIDE_CODES[sides[1]]},
+             # a player presents its token to take its slot back after a drop
+             "tokens": {"a": secrets.token_hex(8), "b": secrets.token_hex(8)}}
+    games[room_code] = state
+
+    for k, side, other in (("a", sides[0], "b"), ("b", sides[1], "a")):
+        send(rm[k]["out"], {"type":"start","your_side":side,"current_player":current,"size":size,
+                            "opponent_name": rm[other]["name"],
+                            "game": game_id, "token": state["tokens"][k]}, rm[k]["proto"])
+    notify_room(rm, state_message(game))
+    fan_out(room_code, watching_message(room_code))
+    fan_out(room_code, state_message(game))
+
+def end_game(room_code):
+    state = games.pop(room_code, None)
+    if state and log_writer:
+        log_writer.close(state["log"])
+
+def leave_slot(room_code, k):
+    """A player is gone for good: free the slot, end the game, tell the room."""
+    rm = rooms[room_code]
+    leaving_name = rm.pop(k)["name"]
+    end_game(room_code)
+    # a dropped player can't resume a game that no longer exists
+    for k2 in [k2 for k2 in ("a","b") if k2 in rm and rm[k2]["w"] is None]:
+        rm.pop(k2)["expire"].cancel()
+    # Notify remaining player that opponent left (stay waiting)
+    notify_room(rm, {"type":"opponent_left","name": leaving_name})
+    notify_room(rm, {"type":"waiting","players": players_list(rm)})
+    fan_out(room_code, {"type":"opponent_left","name": leaving_name})
+    fan_out(room_code, watching_message(room_code))
+    if not rm:
+        del rooms[room_code]
+
+def hold_slot(room_code, k):
+    """Keep a dropped player's slot for RESUME_GRACE seconds."""
+    rm = rooms[room_code]
+    entry = rm[k]
+    entry.update(r=None, w=None, out=None)
+    entry["expire"] = asyncio.get_running_loop().call_later(
+        RESUME_GRACE, expire_slot, room_code, rm, entry)
+    msg = {"type":"opponent_disconnected","name": entry["name"],"grace": RESUME_GRACE}
+    notify_room(rm, msg)
+    fan_out(room_code, msg)
+
+def expire_slot(room_code, rm, entry):
+    if rooms.get(room_code) is not rm:
+        return
+    for k in ("a","b"):
+        if rm.get(k) is entry:
+            leave_slot(room_code, k)
+
+def resume_slot(room_code, hello, reader, writer, out, proto):
+    """Put a reconnecting player back in its slot; returns the slot or None.
+
+    The client sends {"resume": {"game": id, "token": token, "seq": n}} with
+    n the number of moves it has seen and gets only the moves after n.
+    """
+    req = hello.get("resume")
+    state = games.get(room_code)
+    rm = rooms.get(room_code)
+    if not isinstance(req, dict) or state is None or rm is None or req.get("game") != state["id"]:
+        return None
+    slot = next((k for k in ("a","b") if k in rm and state["tokens"][k] == req.get("token")), None)
+    if slot is None:
+        return None
+    try:
+        seq = int(req.get("seq", 0))
+    except (TypeError, ValueError):
+        return None
+    entry = rm[slot]
+    if entry["out"] is not None:
+        # the old socket hasn't noticed it is dead yet
+        entry["out"].abort()
+    else:
+        entry["expire"].cancel()
+    entry.update(r=reader, w=writer, out=out, proto=proto)
+    metrics.resumes += 1
+
+    game, log = state["game"], state["log"]
+    other = "b" if slot == "a" else "a"
+    behind = 0 <= seq <= log.seq
+    send(out, {"type":"resume", "game": state["id"], "size": game.size,
+               "your_side": SIDE_NAMES[state["sides"][slot]],
+               "current_player": SIDE_NAMES[game.current_player],
+               "opponent_name": rm[other]["name"] if other in rm else None,
+               "seq": log.seq, "moves": log.since(seq) if behind else []}, proto)
+    if not behind:
+        # the client counted a move that never reached us: send the whole position
+        send(out, state_message(game), proto)
+    notify_room(rm, {"type":"opponent_resumed","name": entry["name"]}, exclude=writer)
+    return slot
+
+def join_slot(room_code, name, size, reader, writer, out, proto):
+    """Take a free player slot, starting the game when both are filled."""
+    rm = rooms.setdefault(room_code, {})
+    if "a" in rm and "b" in rm:
+        return None
+    slot = "a" if "a" not in rm else "b"
+    rm[slot] = {"r": reader, "w": writer, "out": out, "name": name, "proto": proto, "size": size}
+
+    # Tell everyone current waiting roster
+    notify_room(rm, {"type":"waiting","players": players_list(rm)})
+    notify_room(rm, {"type":"joined","name": name})
+    fan_out(room_code, watching_message(room_code))
+
+    # If pair complete, randomize sides & start
+    if "a" in rm and "b" in rm:
+        start_game(room_code, rm)
+    return slot
+
+# ------------------ HEARTBEATS / SWEEPER ------------------
+def heartbeat(conn, mtype, raw):
+    """Handle a ping/pong from a client (anything else is ignored).
+
+    A client ping {"type":"ping","n":id,"t":client_time} is echoed with the
+    relay's wall clock as "st", which lets the client estimate both the
+    round trip and the offset between the two clocks.
+    """
+    if mtype == "pong":
+        # it speaks heartbeats, so silence from now on means it is gone
+        conn["pongs"] = True
+    elif mtype == "ping":
+        try:
+            ping = decode_raw(raw, conn["proto"])
+        except ValueError:
+            ping = {}
+        send(conn["out"], {"type":"pong","n": ping.get("n"),"t": ping.get("t"),
+                           "st": time.time()}, conn["proto"])
+
+def hang_up(reader, writer):
+    """End a connection's handler as if the client had closed; queued sends still go out."""
+    writer.transport.pause_reading()
+    reader.feed_eof()
+
+def evict_room(room_code):
+    """Close an abandoned room: tell its players and spectators, then hang up on the players."""
+    rm = rooms.pop(room_code)
+    end_game(room_code)
+    msg = {"type":"evicted","reason":"idle"}
+    for entry in rm.values():
+        if entry["out"] is None:
+            entry["expire"].cancel()
+            continue
+        send(entry["out"], msg, entry["proto"])
+        hang_up(entry["r"], entry["w"])
+    fan_out(room_code, msg)
+    metrics.evictions += 1
+
+def sweep_once(now):
+    for writer, conn in list(conns.items()):
+        out = conn["out"]
+        if writer.transport.is_closing():
+            continue   # its handler is on the way out
+        if out.task.done():
+            # the writer task died on a send error but the reader hasn't noticed
+            metrics.error("dead_writer")
+            out.abort()
+        elif conn["pongs"] and now - conn["seen"] > HEARTBEAT_TIMEOUT:
+            metrics.error("heartbeat")
+            out.abort()
+        elif now - conn["seen"] >= HEARTBEAT_INTERVAL and now - conn["pinged"] >= HEARTBEAT_INTERVAL:
+            conn["pinged"] = now
+            send(out, {"type":"ping","t": round(time.time(), 3)}, conn["proto"])
+
+    for room_code, rm in list(rooms.items()):
+        # held slots have their own expiry timer, only connected players count
+        active = [conns[e["w"]]["active"] for e in rm.values() if e["w"] in conns]
+        limit = GAME_IDLE_TIMEOUT if room_code in games else ROOM_IDLE_TIMEOUT
+        if active and now - max(active) > limit:
+            evict_room(room_code)
+
+async def sweep():
+    """Ping idle connections, drop dead ones and evict abandoned rooms, forever."""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        sweep_once(time.monotonic())
 
 async def handle_client(reader, writer):
     slot = None
     room_code = None
+    left = False
+    metrics.connections += 1
+    metrics.connections_total += 1
+    out = Outbox(writer)
+    now = time.monotonic()
+    conn = conns[writer] = {"r": reader, "out": out, "proto": PROTO_JSON,
+                            "seen": now, "active": now, "pinged": now, "pongs": False}
     try:
         # Expect: {"type":"join","room":"1234","name":"Mr X"}
+        #     or: {"type":"quickmatch","name":"Mr X"}
+        # plus an optional "size" (board size, default 9)
         line = await reader.readline()
         if not line:
-            writer.close(); await writer.wait_closed(); return
+            return
         hello = json.loads(line.decode("utf-8").strip())
-        if hello.get("type") != "join" or "room" not in hello:
-            await send(writer, {"type":"error","msg":"bad join"})
-            writer.close(); await writer.wait_closed(); return
+        quickmatch = hello.get("type") == "quickmatch"
+        if not quickmatch and (hello.get("type") != "join" or "room" not in hello):
+            metrics.error("bad_join")
+            send(out, {"type":"error","msg":"bad join"})
+            return
 
-        room_code = str(hello["room"])
+        size = hello.get("size", BOARD_SIZE)
+        if size not in BOARD_SIZES:
+            metrics.error("bad_join")
+            send(out, {"type":"error","msg":f"board size must be one of {list(BOARD_SIZES)}"})
+            return
+        room_code = quickmatch_room(size) if quickmatch else str(hello["room"])
         name = str(hello.get("name","Player"))
 
-        rooms.setdefault(room_code, {})
-
-        if "a" not in rooms[room_code]:
-            slot = "a"
-            rooms[room_code]["a"] = {"r": reader, "w": writer, "name": name}
-        elif "b" not in rooms[room_code]:
-            slot = "b"
-            rooms[room_code]["b"] = {"r": reader, "w": writer, "name": name}
-        else:
-            await send(writer, {"type":"full"})
-            writer.close(); await writer.wait_closed(); return
-
-        # Tell everyone current waiting roster
-        await notify_room(rooms[room_code], {"type":"waiting","players": players_list(rooms[room_code])})
-        await notify_room(rooms[room_code], {"type":"joined","name": name})
-
-        # If pair complete, randomize sides & start
-        rm = rooms[room_code]
-        if "a" in rm and "b" in rm:
-            sides = ["DEFENDER","ATTACKER"]
-            random.shuffle(sides)
-            current = "ATTACKER"   # or "DEFENDER" if you prefer
-
-            a, b = rm["a"], rm["b"]
-            await send(a["w"], {"type":"start","your_side":sides[0],"current_player":current,
-                                "opponent_name": b["name"]})
-            await send(b["w"], {"type":"start","your_side":sides[1],"current_player":current,
-                                "opponent_name": a["name"]})
+        # Negotiate framing: the ack itself is the last JSON line on this socket
+        proto = PROTO_JSON
+        if PROTO_BIN in hello.get("protocols", []):
+            proto = PROTO_BIN
+            send(out, {"type":"proto","mode":PROTO_BIN})
+        conn["proto"] = proto
+
+        if quickmatch:
+            # the client needs the code to resume after a drop
+            send(out, {"type":"room","room": room_code}, proto)
+        elif hello.get("spectate"):
+            await spectate(reader, writer, out, room_code, proto)
+            return
+        elif "resume" in hello:
+            slot = resume_slot(room_code, hello, reader, writer, out, proto)
+            if slot is None:
+                # game over or expired: carry on as a fresh join
+                send(out, {"type":"resume_failed"}, proto)
+        if slot is None:
+            rm = rooms.get(room_code)
+            if rm and room_size(rm) != size:
+                metrics.error("bad_join")
+                n = room_size(rm)
+                send(out, {"type":"error","msg":f"room {room_code} plays on {n}x{n}"}, proto)
+                return
+            slot = join_slot(room_code, name, size, reader, writer, out, proto)
+        if slot is None:
+            metrics.error("room_full")
+            send(out, {"type":"full"}, proto)
+            return
 
         # Forward loop
         while True:
-            line = await reader.readline()
-            if not line:
+            raw = await read_raw(reader, proto)
+            if not raw:
                 break
+            conn["seen"] = now = time.monotonic()
             try:
-                obj = json.loads(line.decode("utf-8").strip())
-            except Exception:
+                mtype, obj = classify(raw, proto)
+            except ValueError:
+                metrics.error("protocol")
+                send(out, {"type":"error","msg":"bad message"}, proto)
+                continue
+            if mtype in CONTROL_TYPES:
+                if mtype == "leave":
+                    left = True
+                    break
+                heartbeat(conn, mtype, raw)
+                continue
+            if mtype not in PEER_TYPES:
+                metrics.error("forbidden_type")
                 continue
-            # Forward to other peer
+            conn["active"] = now
+            notable = None
+            forward = raw
+            if VALIDATE_MOVES and mtype == "move":
+                state = games.get(room_code)
+                err = apply_move(state, slot, obj) if state else "game not started"
+                if err:
+                    metrics.error("rejected_move")
+                    send(out, {"type":"error","msg":err}, proto)
+                    if state:
+                        send(out, state_message(state["game"]), proto)
+                    continue
+                game = state["game"]
+                captured = last_move_captures(game)
+                if captured or game.game_over:
+                    notable = state_message(game, captured)
+                # pass on the move as validated, never the bytes as received
+                # (extra fields, duplicate keys, ...)
+                (fr, fc), (tr, tc) = obj["from"], obj["to"]
+                obj = {"type":"move", "from":[fr, fc], "to":[tr, tc]}
+                forward = None
+            # Forward to other peer: same framing -> the bytes as received
+            # (unvalidated mode only), else encoded for the peer's framing.
+            # A dropped peer gets its moves from the log when it resumes.
             rm = rooms.get(room_code, {})
             other = "b" if slot == "a" else "a"
-            if other in rm:
-                await send(rm[other]["w"], obj)
+            if other in rm and rm[other]["out"] is not None:
+                peer = rm[other]
+                if forward is not None and peer["proto"] == proto:
+                    send_raw(peer["out"], forward)
+                else:
+                    try:
+                        if obj is None:
+                            obj = decode_raw(raw, proto)
+                    except ValueError:
+                        metrics.error("protocol")
+                        continue
+                    send(peer["out"], obj, peer["proto"])
+                metrics.messages += 1
+                metrics.bytes += len(raw)
+            fan_out(room_code, obj, forward, proto)
+            # captures / game over: both sides get the authoritative result
+            if notable:
+                notify_room(rm, notable)
+                fan_out(room_code, notable)
 
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        metrics.error("connection")
+    except (ValueError, asyncio.LimitOverrunError):
+        # unparsable join line, bad frame header, oversized line
+        metrics.error("protocol")
     except Exception:
-        pass
+        metrics.error("internal")
+        traceback.print_exc()
     finally:
-        # Clean-up
+        metrics.connections -= 1
+        conns.pop(writer, None)
+        # Clean-up (nothing to do if a resumed connection has taken the slot over)
+        rm = rooms.get(room_code)
+        if rm is not None:
+            leaving = next((k for k in ("a","b") if k in rm and rm[k]["w"] is writer), None)
+            state = games.get(room_code)
+            if leaving and state and not state["game"].game_over and RESUME_GRACE and not left:
+                hold_slot(room_code, leaving)
+            elif leaving:
+                leave_slot(room_code, leaving)
+            elif not rm:
+                del rooms[room_code]
+        await out.aclose()
+
+# ------------------ SHARDING ------------------
+# With --shards N the parent process only accepts connections. It reads the
+# join line, picks the shard that owns the room code and hands the socket
+# (plus the bytes it already read) to that worker over a Unix socket, so
+# both players of a room always land in the same process. SO_REUSEPORT
+# alone can't do this: the kernel balances by address, not by room.
+def shard_for(room_code, shards):
+    if room_code.startswith(QUICKMATCH_PREFIX):
+        return 0   # the pairing queue is per process
+    return zlib.crc32(room_code.encode("utf-8")) % shards
+
+async def send_to_shard(ctrl, lock, prefix, fd):
+    """Hand fd to a shard without blocking the acceptor while its control socket is full.
+
+    The control sockets are non-blocking; a full one is waited on with
+    add_writer, one sender at a time per shard (a descriptor only has one
+    writer callback), so a lagging shard holds up only its own rooms.
+    """
+    loop = asyncio.get_running_loop()
+    async with lock:
+        while True:
+            try:
+                socket.send_fds(ctrl, [prefix], [fd])
+                return
+            except BlockingIOError:
+                pass
+            writable = loop.create_future()
+            loop.add_writer(ctrl.fileno(), lambda: writable.done() or writable.set_result(None))
+            try:
+                await writable
+            finally:
+                loop.remove_writer(ctrl.fileno())
+
+async def route_connection(conn, shard_socks, shard_locks):
+    loop = asyncio.get_running_loop()
+    try:
+        prefix = b""
+        while b"\n" not in prefix and len(prefix) < MAX_HELLO:
+            chunk = await asyncio.wait_for(loop.sock_recv(conn, MAX_HELLO - len(prefix)), HELLO_TIMEOUT)
+            if not chunk:
+                return
+            prefix += chunk
         try:
-            writer.close(); await writer.wait_closed()
+            hello = json.loads(prefix.split(b"\n", 1)[0])
+            room_code = QUICKMATCH_PREFIX if hello.get("type") == "quickmatch" else str(hello.get("room", ""))
         except Exception:
-            pass
-        if room_code in rooms:
-            rm = rooms[room_code]
-            leaving_name = None
-            for k in ("a","b"):
-                if k in rm and rm[k]["w"] is writer:
-                    leaving_name = rm[k]["name"]
-                    del rm[k]
-                    break
-            if leaving_name:
-                # Notify remaining player that opponent left (stay waiting)
-                await notify_room(rm, {"type":"opponent_left","name": leaving_name})
-                await notify_room(rm, {"type":"waiting","players": players_list(rm)})
-            if not rm:
-                del rooms[room_code]
+            room_code = ""   # the shard will answer "bad join"
+        shard = shard_for(room_code, len(shard_socks))
+        await asyncio.wait_for(send_to_shard(shard_socks[shard], shard_locks[shard],
+                                             prefix, conn.fileno()), HELLO_TIMEOUT)
+    except (asyncio.TimeoutError, OSError):
+        pass
+    finally:
+        # the shard has its own copy of the descriptor now
+        conn.close()
+
+async def run_acceptor(host, port, shard_socks):
+    loop = asyncio.get_running_loop()
+    lsock = socket.create_server((host, port), backlog=1024)
+    lsock.setblocking(False)
+    for ctrl in shard_socks:
+        ctrl.setblocking(False)
+    shard_locks = [asyncio.Lock() for _ in shard_socks]
+    print(f"Relay acceptor listening on {host}:{port} with {len(shard_socks)} shards")
+    while True:
+        conn, _ = await loop.sock_accept(lsock)
+        asyncio.create_task(route_connection(conn, shard_socks, shard_locks))
 
-async def main():
-    server = await asyncio.start_server(handle_client, host="0.0.0.0", port=8765)
-    print("Relay listening on 0.0.0.0:8765")
+async def adopt_connection(fd, prefix):
+    """Wrap a socket handed over by the acceptor in streams and serve it."""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(fileno=fd)
+    sock.setblocking(False)
+    reader = asyncio.StreamReader()
+    # bytes the acceptor already consumed come first
+    reader.feed_data(prefix)
+    protocol = asyncio.StreamReaderProtocol(reader)
+    transport, _ = await loop.connect_accepted_socket(lambda: protocol, sock)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    await handle_client(reader, writer)
+
+def start_move_logs():
+    """Start the batched fsync task; returns it (or None when logging to memory)."""
+    global log_writer
+    if not MOVE_LOG_DIR:
+        return None
+    log_writer = LogWriter(MOVE_LOG_DIR)
+    return asyncio.create_task(log_writer.run())
+
+async def shard_main(ctrl, metrics_port):
+    loop = asyncio.get_running_loop()
+    log_task = start_move_logs()
+    sweeper = asyncio.create_task(sweep())
+    # keep a reference so the rate sampler task isn't collected
+    exporter = metrics_port and await serve_metrics(metrics, METRICS_HOST, metrics_port, room_gauges)
+    closed = asyncio.Event()
+    ctrl.setblocking(False)
+
+    def on_ctrl():
+        try:
+            prefix, fds, _, _ = socket.recv_fds(ctrl, MAX_HELLO, 1)
+        except BlockingIOError:
+            return
+        if not fds and not prefix:
+            closed.set()   # acceptor went away
+            return
+        for fd in fds:
+            asyncio.create_task(adopt_connection(fd, prefix))
+
+    loop.add_reader(ctrl.fileno(), on_ctrl)
+    await closed.wait()
+
+def run_shard(ctrl, metrics_port):
+    asyncio.run(shard_main(ctrl, metrics_port))
+
+def run_sharded(host, port, shards, metrics_port=METRICS_PORT):
+    # spawn, not fork: a forked shard would inherit the other shards' control
+    # sockets and never see EOF when the acceptor exits
+    ctx = multiprocessing.get_context("spawn")
+    shard_socks = []
+    workers = []
+    for i in range(shards):
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        p = ctx.Process(target=run_shard, args=(child_end, metrics_port and metrics_port + i),
+                        daemon=True)
+        p.start()
+        child_end.close()
+        shard_socks.append(parent_end)
+        workers.append(p)
+    try:
+        asyncio.run(run_acceptor(host, port, shard_socks))
+    finally:
+        for p in workers:
+            p.terminate()
+
+async def main(host=HOST, port=PORT, metrics_port=METRICS_PORT):
+    log_task = start_move_logs()
+    sweeper = asyncio.create_task(sweep())
+    # keep a reference so the rate sampler task isn't collected
+    exporter = metrics_port and await serve_metrics(metrics, METRICS_HOST, metrics_port, room_gauges)
+    server = await asyncio.start_server(handle_client, host=host, port=port)
+    print(f"Relay listening on {host}:{port}")
     async with server:
         await server.serve_forever()
 
 if __name__ == "__main__":
-    asyncio.run(main())
-
+    parser = argparse.ArgumentParser(description="Hnefatafl relay server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--shards", type=int, default=1,
+                        help="worker processes; rooms are pinned to a shard by room code")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="local Prometheus text endpoint, 0 disables (shard i uses port + i)")
+    args = parser.parse_args()
+    if args.shards > 1:
+        run_sharded(args.host, args.port, args.shards, args.metrics_port)
+    else:
+        asyncio.run(main(args.host, args.port, args.metrics_port))
@@ -0,0 +1,424 @@
+# search.py
+# Computer opponent: iterative-deepening alpha-beta over the Hnefatafl engine.
+#
+# The search works on its own engine copy (game.clone()) using
+# make_move/unmake_move, so it can run on a background thread while the
+# pygame loop keeps drawing the real game.
+import os
+import threading
+import queue
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from bitboard import KING, DEFENDER, ATTACKER, VICTIM, MOVE_SHIFT, MOVE_MASK, decode_move
+from zobrist import TranspositionTable, EXACT, LOWER, UPPER
+
+WIN_SCORE = 100000
+# scores beyond this are "win in N plies" and get ply-adjusted in the TT
+WIN_BOUND = WIN_SCORE - 1000
+MAX_DEPTH = 64
+
+# evaluate() weights, in order: defender material, attacker material, king
+# mobility, open king routes to an escape square, attackers next to the king,
+# king distance from the nearest escape square. Self-play tuning passes its own tuple to Searcher.
+DEFAULT_WEIGHTS = (200, 100, 10, 400, 60, 15)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult:
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        self.move = move          # (from_sq, to_sq) or None
+        self.score = score        # from the side to move's point of view
+        self.depth = depth        # deepest fully completed iteration
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv              # principal variation, list of (from_sq, to_sq)
+        # (depth, score, move, pv) for every completed iteration
+        self.iterations = []
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def __repr__(self):
+        return (f"SearchResult(move={self.move}, score={self.score}, depth={self.depth}, "
+                f"nodes={self.nodes}, nps={self.nps})")
+
+
+# ------------------ MOVES / EVAL ------------------
+def move_order_key(game, move):
+    """Higher is searched first: king escapes, captures, king moves towards escape squares."""
+    from_sq = move >> MOVE_SHIFT
+    to_sq = move & MOVE_MASK
+    bb = game.bitboards
+    geo = game.geo
+    piece = game.piece_at(from_sq)
+    if piece == KING:
+        if geo.escape_mask & (1 << to_sq):
+            return 10000
+        distance = geo.escape_distance
+        return 100 + 10 * (distance[from_sq] - distance[to_sq])
+    victim = VICTIM[piece]
+    score = 0
+    for target_sq, target_bit, beyond_bit in geo.capture_pairs[to_sq]:
+        if bb[victim] & target_bit and bb[piece] & beyond_bit:
+            score += 1000
+        elif bb[KING] & target_bit:
+            score += 300
+    return score
+
+
+def evaluate(game, weights=DEFAULT_WEIGHTS):
+    """Static score from the point of view of the side to move."""
+    w_def, w_att, w_mobility, w_route, w_pressure, w_distance = weights
+    bb = game.bitboards
+    counts = game.piece_counts
+    king_sq = game.king_sq
+    # defenders are outnumbered two to one, so each one is worth two attackers
+    score = w_def * counts[DEFENDER] - w_att * counts[ATTACKER]
+    if king_sq is not None:
+        geo = game.geo
+        reach = geo.sliding_moves(king_sq, game.occupied())
+        score += w_mobility * reach.bit_count()
+        # every open route to an escape square is a threat to escape next move
+        score += w_route * (reach & geo.escape_mask).bit_count()
+        score -= w_pressure * (geo.neighbour_mask[king_sq] & bb[ATTACKER]).bit_count()
+        score -= w_distance * geo.escape_distance[king_sq]
+    return score if game.current_player == DEFENDER else -score
+
+
+# ------------------ SEARCH ------------------
+class Searcher:
+    """Iterative-deepening negamax alpha-beta with a transposition table.
+
+    With symmetric=True the table is keyed on the canonical hash, so the 8
+    rotations/reflections of a position share one entry; best moves are
+    stored in the canonical orientation and mapped back on probe.
+    """
+
+    def __init__(self, tt=None, weights=DEFAULT_WEIGHTS, symmetric=False):
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.weights = weights
+        self.symmetric = symmetric
+        self.nodes = 0
+        self.deadline = None
+        self.stop_event = threading.Event()
+        # one generate_moves buffer per ply so recursion never reallocates;
+        # sized for the board of the game being searched (see _size_buffers)
+        self.buffers = []
+
+    def _size_buffers(self, game):
+        if not self.buffers or len(self.buffers[0]) < game.geo.max_moves:
+            self.buffers = [array("I", bytes(4 * game.geo.max_moves))
+                            for _ in range(MAX_DEPTH + 1)]
+
+    def search(self, game, time_budget=2.0, max_depth=MAX_DEPTH, root_moves=None):
+        """Search game (mutated during the search, restored on return).
+
+        root_moves optionally restricts the root to a subset of encoded
+        moves; parallel_search uses it to split the root between workers.
+        """
+        start = time.perf_counter()
+        self.deadline = start + time_budget if time_budget else None
+        self.nodes = 0
+        self.stop_event.clear()
+        self._size_buffers(game)
+        if self.symmetric:
+            game.enable_symmetric()
+
+        n = game.generate_moves(game.current_player, self.buffers[0])
+        if game.game_over or not n:
+            return SearchResult(None, evaluate(game, self.weights), 0, 0, 0.0, [])
+        moves = self.buffers[0][:n].tolist()
+        if root_moves is not None:
+            moves = [m for m in moves if m in root_moves]
+            if not moves:
+                return SearchResult(None, -WIN_SCORE - 1, 0, 0, 0.0, [])
+        # something legal even if the first iteration times out
+        best = SearchResult(decode_move(moves[0]), 0, 0, 0, 0.0, [decode_move(moves[0])])
+        iterations = []
+
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self._root(game, moves, depth)
+            except SearchTimeout:
+                break
+            elapsed = time.perf_counter() - start
+            best = SearchResult(decode_move(move), score, depth, self.nodes, elapsed,
+                                self._principal_variation(game, depth))
+            iterations.append((depth, score, best.move, best.pv))
+            # search the last best move first next iteration
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= WIN_BOUND:
+                break
+        best.nodes = self.nodes
+        best.elapsed = time.perf_counter() - start
+        best.iterations = iterations
+        return best
+
+    def _check_time(self):
+        if self.stop_event.is_set() or (self.deadline and time.perf_counter() > self.deadline):
+            raise SearchTimeout()
+
+    def _tt_key(self, game):
+        """(key, symmetry) for the TT; symmetry is None when moves are stored as played."""
+        if self.symmetric:
+            return game.canonical_key()
+        return game.zobrist_hash(), None
+
+    def _root(self, game, moves, depth):
+        alpha, beta = -WIN_SCORE - 1, WIN_SCORE + 1
+        best_move = moves[0]
+        # keep the previous best first, order the rest
+        rest = sorted(moves[1:], key=lambda m: move_order_key(game, m), reverse=True)
+        for move in [moves[0]] + rest:
+            game.make_move(move >> MOVE_SHIFT, move & MOVE_MASK)
+            try:
+                score = -self._negamax(game, depth - 1, -beta, -alpha, 1)
+            finally:
+                game.unmake_move()
+            if score > alpha:
+                alpha, best_move = score, move
+        key, sym = self._tt_key(game)
+        self.tt.store(key, depth, alpha, EXACT, _to_tt_move(game, best_move, sym))
+        return alpha, best_move
+
+    def _negamax(self, game, depth, alpha, beta, ply):
+        if ply >= MAX_DEPTH:
+            return evaluate(game, self.weights)
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self._check_time()
+
+        if game.game_over:
+            if game.winner == game.current_player:
+                return WIN_SCORE - ply
+            return -(WIN_SCORE - ply)
+        if game.repetitions() > 1:
+            return 0
+        if depth <= 0:
+            return evaluate(game, self.weights)
+
+        key, sym = self._tt_key(game)
+        alpha_orig = alpha
+        tt_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_depth, tt_score, tt_flag, tt_move = entry
+            tt_move = _from_tt_move(game, tt_move, sym)
+            if tt_depth >= depth:
+                tt_score = _score_from_tt(tt_score, ply)
+                if tt_flag == EXACT:
+                    return tt_score
+                if tt_flag == LOWER:
+                    alpha = max(alpha, tt_score)
+                elif tt_flag == UPPER:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+
+        n = game.generate_moves(game.current_player, self.buffers[ply])
+        if not n:
+            # a side that cannot move loses
+            return -(WIN_SCORE - ply)
+        moves = sorted(self.buffers[ply][:n], key=lambda m: move_order_key(game, m), reverse=True)
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+
+        best_score = -WIN_SCORE - 1
+        best_move = None
+        for move in moves:
+            game.make_move(move >> MOVE_SHIFT, move & MOVE_MASK)
+            try:
+                score = -self._negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                game.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= alpha_orig:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, _score_to_tt(best_score, ply), flag,
+                      _to_tt_move(game, best_move, sym))
+        return best_score
+
+    def _principal_variation(self, game, depth):
+        pv = []
+        for _ in range(depth):
+            key, sym = self._tt_key(game)
+            entry = self.tt.probe(key)
+            if entry is None or entry[3] is None or game.game_over:
+                break
+            from_sq, to_sq = decode_move(_from_tt_move(game, entry[3], sym))
+            if not game.legal_targets(from_sq) & (1 << to_sq):
+                break
+            pv.append((from_sq, to_sq))
+            game.make_move(from_sq, to_sq)
+        for _ in pv:
+            game.unmake_move()
+        return pv
+
+
+def _to_tt_move(game, move, sym):
+    """Move as stored in the TT: in the canonical orientation when sym is set."""
+    if sym is None or move is None:
+        return move
+    perm = game.geo.symmetries[sym]
+    return perm[move >> MOVE_SHIFT] << MOVE_SHIFT | perm[move & MOVE_MASK]
+
+
+def _from_tt_move(game, move, sym):
+    """Inverse of _to_tt_move: a stored move in this position's orientation."""
+    if sym is None or move is None:
+        return move
+    perm = game.geo.inverse_symmetries[sym]
+    return perm[move >> MOVE_SHIFT] << MOVE_SHIFT | perm[move & MOVE_MASK]
+
+
+def _score_to_tt(score, ply):
+    if score >= WIN_BOUND:
+        return score + ply
+    if score <= -WIN_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    if score >= WIN_BOUND:
+        return score - ply
+    if score <= -WIN_BOUND:
+        return score + ply
+    return score
+
+
+# ------------------ PARALLEL ROOT SEARCH ------------------
+def _search_root_subset(engine_cls, packed, root_moves, time_budget, max_depth,
+                        weights=DEFAULT_WEIGHTS, symmetric=False):
+    """Worker entry point: rebuild the position from its packed form and search a root subset."""
+    game = engine_cls.from_packed(packed)
+    searcher = Searcher(weights=weights, symmetric=symmetric)
+    return searcher.search(game, time_budget, max_depth, root_moves=set(root_moves))
+
+
+def parallel_search(game, workers=None, time_budget=2.0, max_depth=MAX_DEPTH, executor=None,
+                    weights=DEFAULT_WEIGHTS, symmetric=False):
+    """Split the root moves of game across a process pool and merge the results.
+
+    Workers receive game.pack() (a few ints) plus the engine class by
+    reference, never the Hnefatafl object itself, so pygame and socket
+    state stay in this process. Each worker deepens its own share of the
+    root; the answer is taken at the deepest iteration every worker
+    finished, so all scores compared come from the same depth. A worker
+    whose share is proven won or lost stops deepening early; it doesn't
+    hold the others back, its proven score is carried to that depth.
+
+    Pass a long-lived executor to avoid paying process start-up per move.
+    weights and symmetric are handed to every worker's Searcher.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    buf = array("I", bytes(4 * game.geo.max_moves))
+    n = game.generate_moves(game.current_player, buf)
+    if game.game_over or not n:
+        return SearchResult(None, evaluate(game, weights), 0, 0, 0.0, [])
+
+    # deal moves out best-first so every worker gets some promising ones
+    moves = sorted(buf[:n], key=lambda m: move_order_key(game, m), reverse=True)
+    workers = min(workers, len(moves))
+    shares = [moves[i::workers] for i in range(workers)]
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        packed = game.pack()
+        futures = [executor.submit(_search_root_subset, type(game), packed, share,
+                                   time_budget, max_depth, weights, symmetric) for share in shares]
+        results = [f.result() for f in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    nodes = sum(r.nodes for r in results)
+    finished = [r for r in results if r.iterations]
+    if not finished:
+        # nobody completed depth 1 in time; fall back to the best-ordered move
+        first = decode_move(moves[0])
+        return SearchResult(first, 0, 0, nodes, time.perf_counter() - start, [first])
+
+    # Searcher.search stops at a win/loss score, which no deeper iteration changes
+    open_ended = [r for r in finished if abs(r.iterations[-1][1]) < WIN_BOUND]
+    if open_ended:
+        depth = min(r.iterations[-1][0] for r in open_ended)
+    else:
+        depth = max(r.iterations[-1][0] for r in finished)
+    best = None
+    for r in finished:
+        it_depth, score, move, pv = r.iterations[min(depth, len(r.iterations)) - 1]
+        if best is None or score > best[1]:
+            best = (it_depth, score, move, pv)
+    return SearchResult(best[2], best[1], depth, nodes, time.perf_counter() - start, best[3])
+
+
+# ------------------ BACKGROUND PLAYER ------------------
+class AIPlayer:
+    """Runs searches on a worker thread; results come back through self.results.
+
+    The pygame loop calls start() when it is the computer's turn and poll()
+    every frame, so the frame rate never depends on search time. on_done, if
+    given, is called from the worker thread once a result is ready, so an
+    idle loop can sleep until then.
+    """
+
+    def __init__(self, side, time_budget=2.0, max_depth=MAX_DEPTH, on_done=None, symmetric=False):
+        self.side = side              # DEFENDER or ATTACKER
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.on_done = on_done
+        self.searcher = Searcher(symmetric=symmetric)
+        self.results = queue.Queue()
+        self.busy = False             # a search is running or its result is unread
+        self.t = None
+
+    def start(self, game):
+        if self.busy:
+            return
+        self.busy = True
+        position = game.clone()
+        self.t = threading.Thread(target=self._run, args=(position,), daemon=True)
+        self.t.start()
+
+    def _run(self, position):
+        result = None
+        try:
+            result = self.searcher.search(position, self.time_budget, self.max_depth)
+        finally:
+            self.results.put(result)
+            if self.on_done:
+                self.on_done()
+
+    def poll(self):
+        """Finished SearchResult, or None while still thinking."""
+        try:
+            result = self.results.get_nowait()
+        except queue.Empty:
+            return None
+        self.busy = False
+        return result
+
+    def stop(self):
+        self.searcher.stop_event.set()
@@ -0,0 +1,163 @@
+# selfplay.py
+# Headless engine-vs-engine tournaments across all cores.
+#
+#   python selfplay.py --games 2000 --depth 2 -o selfplay.jsonl
+#   python selfplay.py --games 500 --time 0.2 --defender-weights 200,100,10,500,60,15
+#   python selfplay.py --games 200 --size 11 --depth 1
+#
+# Every finished game is appended to the output file as one JSON line
+# (winner, plies, move list, seconds per move) and a running summary is
+# printed to stderr, so long runs can be watched or cut short at any time.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bitboard import DEFENDER, ATTACKER, BOARD_SIZE, BOARD_SIZES, decode_move
+from search import Searcher, DEFAULT_WEIGHTS
+from engine import Hnefatafl
+
+SIDE_NAMES = {DEFENDER: "DEFENDER", ATTACKER: "ATTACKER", None: None}
+
+
+def play_game(index, seed, first, depth, time_budget, max_plies, random_plies,
+              defender_weights, attacker_weights, size=BOARD_SIZE, symmetric=False):
+    """Play one game in a worker process and return its record as a dict."""
+    rnd = random.Random(seed)
+    game = Hnefatafl(size=size)
+    game.current_player = first
+    searchers = {DEFENDER: Searcher(weights=defender_weights, symmetric=symmetric),
+                 ATTACKER: Searcher(weights=attacker_weights, symmetric=symmetric)}
+    buf = array("I", bytes(4 * game.geo.max_moves))
+    moves, times = [], []
+    reason = "max_plies"
+    start = time.perf_counter()
+
+    while len(moves) < max_plies:
+        if game.game_over:
+            reason = "king_escaped" if game.winner == DEFENDER else "king_captured"
+            break
+        if game.repetitions() >= 3:
+            reason = "repetition"
+            break
+        t0 = time.perf_counter()
+        if len(moves) < random_plies:
+            # randomised opening so games with the same settings differ
+            n = game.generate_moves(game.current_player, buf)
+            move = decode_move(buf[rnd.randrange(n)]) if n else None
+        else:
+            move = searchers[game.current_player].search(game, time_budget, depth).move
+        if move is None:
+            reason = "no_moves"
+            break
+        game.make_move(*move)
+        times.append(round(time.perf_counter() - t0, 4))
+        moves.append([divmod(move[0], size), divmod(move[1], size)])
+
+    winner = game.winner if game.game_over else None
+    if reason == "no_moves":
+        # the side left without a move loses
+        winner = ATTACKER if game.current_player == DEFENDER else DEFENDER
+    return {
+        "game": index,
+        "seed": seed,
+        "size": size,
+        "first": SIDE_NAMES[first],
+        "winner": SIDE_NAMES[winner],
+        "reason": reason,
+        "plies": len(moves),
+        "seconds": round(time.perf_counter() - start, 3),
+        "moves": moves,
+        "move_times": times,
+    }
+
+
+class Summary:
+    def __init__(self):
+        self.games = 0
+        self.wins = {"DEFENDER": 0, "ATTACKER": 0, None: 0}
+        self.plies = 0
+
+    def add(self, record):
+        self.games += 1
+        self.wins[record["winner"]] += 1
+        self.plies += record["plies"]
+
+    def line(self):
+        g = self.games or 1
+        return (f"{self.games} games | defenders {100 * self.wins['DEFENDER'] / g:.1f}% | "
+                f"attackers {100 * self.wins['ATTACKER'] / g:.1f}% | "
+                f"draws {100 * self.wins[None] / g:.1f}% | avg length {self.plies / g:.1f} plies")
+
+    def as_dict(self):
+        g = self.games or 1
+        return {"games": self.games,
+                "defender_win_rate": self.wins["DEFENDER"] / g,
+                "attacker_win_rate": self.wins["ATTACKER"] / g,
+                "draw_rate": self.wins[None] / g,
+                "avg_plies": self.plies / g}
+
+
+def parse_weights(text):
+    if text is None:
+        return DEFAULT_WEIGHTS
+    weights = tuple(int(w) for w in text.split(","))
+    if len(weights) != len(DEFAULT_WEIGHTS):
+        raise argparse.ArgumentTypeError(f"expected {len(DEFAULT_WEIGHTS)} comma separated weights")
+    return weights
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Hnefatafl self-play tournament")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--size", type=int, choices=BOARD_SIZES, default=BOARD_SIZE,
+                        help=f"board size (default {BOARD_SIZE})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--depth", type=int, default=2, help="search depth per move (default 2)")
+    parser.add_argument("--time", type=float, default=None,
+                        help="seconds per move; the search stops at --depth or this, whichever is first")
+    parser.add_argument("--max-plies", type=int, default=200, help="adjudicate as a draw after this many plies")
+    parser.add_argument("--random-plies", type=int, default=2, help="random opening plies per game")
+    parser.add_argument("--first", choices=["attacker", "defender"], default="attacker",
+                        help="side that moves first (the online relay starts with the attackers)")
+    parser.add_argument("--defender-weights", type=parse_weights, default=None,
+                        help="evaluation weights for the defenders, comma separated")
+    parser.add_argument("--attacker-weights", type=parse_weights, default=None,
+                        help="evaluation weights for the attackers, comma separated")
+    parser.add_argument("--symmetric", action="store_true",
+                        help="key the transposition tables on the symmetry-folded hash")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="selfplay.jsonl", help="JSON lines output file")
+    args = parser.parse_args(argv)
+
+    first = ATTACKER if args.first == "attacker" else DEFENDER
+    defender_weights = args.defender_weights or DEFAULT_WEIGHTS
+    attacker_weights = args.attacker_weights or DEFAULT_WEIGHTS
+    summary = Summary()
+
+    with open(args.output, "a") as out, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(play_game, i, args.seed * 1000003 + i, first, args.depth, args.time,
+                               args.max_plies, args.random_plies, defender_weights, attacker_weights,
+                               args.size, args.symmetric)
+                   for i in range(args.games)]
+        try:
+            for future in as_completed(futures):
+                record = future.result()
+                out.write(json.dumps(record, separators=(",", ":")) + "\n")
+                out.flush()
+                summary.add(record)
+                print(summary.line(), file=sys.stderr)
+        except KeyboardInterrupt:
+            for f in futures:
+                f.cancel()
+            print("interrupted", file=sys.stderr)
+
+    print(json.dumps(summary.as_dict()))
+
+
+if __name__ == "__main__":
+    main()
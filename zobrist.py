@@ -0,0 +1,114 @@
+# zobrist.py
+# Zobrist keys for Hnefatafl positions and a fixed-size transposition table.
+#
+# Keys are generated from a fixed seed per board size so hashes are stable
+# across runs and processes (needed when comparing replays or sharing tables).
+import random
+
+from bitboard import BOARD_SIZE, GEOMETRIES, iter_bits
+
+ZOBRIST_SEED = 0x48E4E7A7
+PIECE_TYPES = 3   # KING, DEFENDER, ATTACKER
+
+
+class ZobristKeys:
+    """Keys for one board size, shared by every game of that size.
+
+    piece_keys[piece][sq], side_key (mixed in when the attackers are to
+    move) and sym_piece_keys[k][piece][sq] == piece_keys[piece][symmetries[k][sq]]
+    for the 8 board symmetries (see Geometry.symmetries). The default size
+    uses ZOBRIST_SEED itself, so its hashes are unchanged from before other
+    sizes existed.
+    """
+
+    def __init__(self, geo):
+        seed = ZOBRIST_SEED if geo.size == BOARD_SIZE else ZOBRIST_SEED + geo.size
+        rng = random.Random(seed)
+        n = geo.num_squares
+        self.piece_keys = [[rng.getrandbits(64) for _ in range(n)] for _ in range(PIECE_TYPES)]
+        self.side_key = rng.getrandbits(64)
+        self.sym_piece_keys = [[[keys[perm[sq]] for sq in range(n)] for keys in self.piece_keys]
+                               for perm in geo.symmetries]
+
+
+KEYS = {size: ZobristKeys(geo) for size, geo in GEOMETRIES.items()}
+
+
+def hash_bitboards(bitboards, keys):
+    """Hash piece placement from scratch (no side-to-move key); keys is piece_keys[piece][sq]."""
+    h = 0
+    for piece, mask in enumerate(bitboards):
+        piece_keys = keys[piece]
+        for sq in iter_bits(mask):
+            h ^= piece_keys[sq]
+    return h
+
+
+# ------------------ TRANSPOSITION TABLE ------------------
+EXACT = 0
+LOWER = 1   # score is a lower bound (fail high)
+UPPER = 2   # score is an upper bound (fail low)
+
+
+class TranspositionTable:
+    """Fixed-size hash table of search results.
+
+    Each bucket has two slots: a depth-preferred slot that is only
+    overwritten by an equal or deeper search (or the same position), and an
+    always-replace slot that takes everything else. Storage is a set of
+    preallocated parallel lists, so the table never grows.
+    """
+
+    def __init__(self, buckets=1 << 16):
+        if buckets & (buckets - 1):
+            raise ValueError("buckets must be a power of two")
+        self.mask = buckets - 1
+        size = buckets * 2
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.scores = [0] * size
+        self.flags = [EXACT] * size
+        self.moves = [None] * size
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return sum(1 for d in self.depths if d >= 0)
+
+    def clear(self):
+        size = len(self.keys)
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.scores = [0] * size
+        self.flags = [EXACT] * size
+        self.moves = [None] * size
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        """Return (depth, score, flag, move) for key, or None."""
+        self.probes += 1
+        slot = (key & self.mask) << 1
+        for i in (slot, slot + 1):
+            if self.keys[i] == key and self.depths[i] >= 0:
+                self.hits += 1
+                return self.depths[i], self.scores[i], self.flags[i], self.moves[i]
+        return None
+
+    def store(self, key, depth, score, flag, move=None):
+        slot = (key & self.mask) << 1
+        if self.keys[slot] == key or depth >= self.depths[slot]:
+            # demote the old deep entry to the always-replace slot
+            if self.keys[slot] != key and self.depths[slot] >= 0:
+                self._write(slot + 1, self.keys[slot], self.depths[slot],
+                            self.scores[slot], self.flags[slot], self.moves[slot])
+            self._write(slot, key, depth, score, flag, move)
+        else:
+            self._write(slot + 1, key, depth, score, flag, move)
+
+    def _write(self, i, key, depth, score, flag, move):
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.scores[i] = score
+        self.flags[i] = flag
+        self.moves[i] = move